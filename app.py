@@ -3,17 +3,365 @@
 # pip install streamlit qrcode numpy opencv-python Pillow pyzbar
 
 import streamlit as st
-import io
-from utils import split_and_combine
-from controlnet import ControlnetRequest
+import base64
+from payloads import PAYLOAD_BUILDERS, build_payload
+from metrics import METRICS, span, start_http_server
 import shutil
 import os
-from PIL import Image
-import base64
-from faker import Faker
-from pyzbar.pyzbar import decode
-import numpy as np
-import qrcode
+import time
+
+# Streamlit reruns this script on every interaction. Modules that pull in cv2,
+# pyzbar, qrcode/NumPy or faker are imported inside the functions of the pages
+# that use them, so Home and the input pages never load them.
+
+DEFAULT_PROMPTS = ("Undersea marine life", "NYC skyline", "Amazon Rainforest", "Anime sword battle")
+
+SAMPLING_METHODS = {"Random": "random", "Latin hypercube": "lhs"}
+
+def sweep_options():
+    """Shows the shared sweep settings and returns them as a dict."""
+    from backend_pool import DEFAULT_BACKENDS
+    options = {
+        "concurrency": st.number_input("Concurrent requests", min_value=1, max_value=64, value=2, help="Total number of txt2img requests kept in flight across all backends"),
+        "backends": st.text_area("Automatic1111 backends", value=DEFAULT_BACKENDS, help="One webui running in api mode per line, as: url [concurrency] [weight]"),
+        "repeats": st.number_input("Images per combination", min_value=1, max_value=64, value=1, help="Images rendered with consecutive seeds for every parameter combination, sent as one batched request"),
+        "vram_gb": st.number_input("VRAM budget (GB)", min_value=0.0, value=0.0, step=1.0, help="Caps how many images a backend renders at once, 0 renders one image at a time"),
+        "budget": st.number_input("Job budget per prompt", min_value=0, value=0, help="Maximum number of parameter combinations to run per prompt, 0 runs all of them"),
+        "sampling": SAMPLING_METHODS[st.selectbox("Sampling", list(SAMPLING_METHODS), help="How combinations are picked when the grid is larger than the budget")],
+        "seed": st.number_input("Seed", min_value=-1, value=-1, help="-1 for a random seed per job, any other value gives every job a reproducible seed"),
+        "use_cache": st.checkbox("Reuse cached results", value=True, help="Skip rendering jobs with a fixed seed that were already generated"),
+        "optimize": st.checkbox("Optimize for scannability", help="Search the control weight per prompt instead of running the whole grid, stopping once enough images scan. Runs in the background like any other sweep"),
+    }
+    if options["optimize"]:
+        col1, col2 = st.columns(2)
+        options["min_weight"] = col1.number_input("Lowest control weight", min_value=0.0, max_value=2.0, value=0.5, step=0.05)
+        options["max_weight"] = col2.number_input("Highest control weight", min_value=0.0, max_value=2.0, value=1.6, step=0.05)
+        options["target"] = col1.number_input("Scannable results per prompt", min_value=1, value=3)
+        options["max_jobs"] = col2.number_input("Max jobs per prompt", min_value=1, value=12)
+    return options
+
+def qr_data_inputs():
+    """Shows the input widgets for the selected QR type and returns the payload."""
+    input_type = st.selectbox("Select the type of data for the QR code", list(PAYLOAD_BUILDERS))
+    fields = {}
+
+    if input_type == "Text":
+        fields["text"] = st.text_area("Enter the text to encode in the QR code")
+
+    elif input_type == "URL":
+        fields["url"] = st.text_input("Enter the URL to encode in the QR code")
+
+    elif input_type == "Email":
+        fields["email"] = st.text_input("Enter the email address")
+        fields["subject"] = st.text_input("Enter the subject")
+        fields["body"] = st.text_area("Enter the email body")
+
+    elif input_type == "WiFi":
+        fields["ssid"] = st.text_input("Enter the WiFi SSID")
+        fields["password"] = st.text_input("Enter the WiFi Password")
+        fields["encryption"] = st.selectbox("Select encryption type", ["WPA", "WEP", "None"])
+
+    elif input_type == "Contact":
+        st.subheader("Enter Contact Information")
+        fields["full_name"] = st.text_input("Full Name")
+        fields["organization"] = st.text_input("Organization")
+        fields["address"] = st.text_input("Address")
+        fields["phone"] = st.text_input("Phone")
+        fields["email"] = st.text_input("Email")
+        fields["notes"] = st.text_area("Notes")
+
+    return build_payload(input_type, fields)
+
+@st.cache_resource
+def get_faker():
+    """Faker loads all of its providers on creation, build it once per process."""
+    from faker import Faker
+    return Faker()
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def qr_outputs(qr_data, color="black", formats=("png",), sizes=("screen",)):
+    """{(size, format): bytes} of a plain QR code from one matrix, shared by every session."""
+    from qrgen import render_outputs
+    return render_outputs(qr_data, formats, sizes, color=color)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def control_image(qr_data, **settings):
+    """PNG bytes and a description of a ControlNet control image, see control_image.py."""
+    from control_image import build_control_image
+    image = build_control_image(qr_data, **settings)
+    return image.png, image.as_dict()
+
+def control_image_options():
+    """Shows the control image settings and returns them as build_control_image keyword arguments."""
+    with st.expander("Control image settings"):
+        col1, col2 = st.columns(2)
+        error_correction = col1.selectbox("Error correction", ["auto", "L", "M", "Q", "H"], help="auto picks the strongest level that keeps modules at least 8px wide")
+        version = col2.selectbox("Version", ["auto"] + list(range(1, 41)), help="auto picks the smallest version the data fits in")
+        mode = col1.selectbox("Encoding mode", ["auto", "Numeric", "Alphanumeric", "Byte"], help="auto splits the data into the most compact segments")
+        quiet_zone = col2.number_input("Quiet zone (modules)", min_value=0, max_value=8, value=4)
+    return {"error_correction": error_correction, "version": None if version == "auto" else version,
+            "mode": mode, "quiet_zone": quiet_zone}
+
+@st.cache_data(max_entries=32, show_spinner="Decoding...")
+def decode_files(files):
+    """Decodes a tuple of (name, bytes) uploads, so reruns do not decode the same files again."""
+    from decoder import decode_many
+    return decode_many(files)
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def rank_directory(out_dir, payload, done, control_path=None):
+    """Scannability ranking of a sweep's images, recomputed when the number of done jobs changes."""
+    from scoring import load_control_layout, score_directory
+    layout = load_control_layout(control_path) if control_path and os.path.exists(control_path) else None
+    return [(os.path.basename(path), score.as_dict()) for path, score in score_directory(out_dir, payload, layout=layout)]
+
+def show_result(result):
+    from results_store import sidecar_paths
+    with span("ui_render"):
+        st.write(result.job.prompt)
+        st.write({**result.job.params, "seed": result.seed, "cached": result.cached, "scannable": result.scannable})
+        if result.ok:
+            thumbnail_path = sidecar_paths(result.path)[0]
+            st.image(thumbnail_path if os.path.exists(thumbnail_path) else result.path)
+        else:
+            st.error(f"Generation failed: {result.error}")
+
+@st.cache_resource
+def get_results_store(out_dir):
+    """Sidecar index of an output folder, kept across reruns so only new results are read."""
+    from results_store import ResultsStore
+    return ResultsStore(out_dir)
+
+GALLERY_PAGE_SIZES = [12, 24, 48]
+SCANNABLE_FILTERS = {"Any": "any", "Scannable": "yes", "Not scannable": "no", "Not checked": "unchecked"}
+
+def show_gallery(out_dir, key="gallery", columns=4):
+    """Paginated, filterable thumbnails of a sweep's results, full size images are loaded on request."""
+    store = get_results_store(out_dir)
+    prompts = store.prompts()
+    if not prompts:
+        return
+
+    st.subheader("Results")
+    col1, col2, col3, col4 = st.columns(4)
+    prompt = col1.selectbox("Prompt", ["All"] + prompts, key=f"{key}_prompt")
+    scannable = SCANNABLE_FILTERS[col2.selectbox("Scannable", list(SCANNABLE_FILTERS), key=f"{key}_scannable")]
+    newest_first = col3.selectbox("Order", ["Newest first", "Oldest first"], key=f"{key}_order") == "Newest first"
+    page_size = col4.selectbox("Per page", GALLERY_PAGE_SIZES, key=f"{key}_page_size")
+
+    _, total = store.query(None if prompt == "All" else prompt, scannable, page_size=0)
+    pages = max(1, -(-total // page_size))
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        # Filters changed and the old page no longer exists
+        st.session_state[f"{key}_page"] = pages
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=f"{key}_page") - 1
+    rows, total = store.query(None if prompt == "All" else prompt, scannable, newest_first, page, page_size)
+    st.write(f"{total} results")
+
+    full_key = f"{key}_full"
+    full = st.session_state.get(full_key)
+    if full and os.path.exists(full["image_path"]):
+        st.image(full["image_path"], caption=f"{full['prompt']} (seed {full['seed']})")
+        st.write(full["params"])
+        if st.button("Close", key=f"{key}_close"):
+            del st.session_state[full_key]
+            st.rerun()
+
+    with span("ui_render"):
+        for start in range(0, len(rows), columns):
+            for column, row in zip(st.columns(columns), rows[start:start + columns]):
+                column.image(row["thumbnail_path"], use_container_width=True)
+                column.caption(f"{row['prompt']} | seed {row['seed']} | " + ", ".join(f"{name} {value}" for name, value in row["params"].items()))
+                if column.button("Full size", key=f"{key}_full_{row['image']}"):
+                    st.session_state[full_key] = row
+                    st.rerun()
+
+def run_sweep(prompts, params_to_combine, enable_hr, path, out_dir, options, payload=None):
+    """Runs every prompt x parameter combination and shows results as they complete."""
+    from backend_pool import get_backend_pool
+    from sweep import build_jobs, max_batch_for_vram
+    from utils import ParamGrid
+    try:
+        list_of_params_to_run = ParamGrid(params_to_combine)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    if len(list_of_params_to_run) == 0:
+        st.error("Every parameter needs at least one value.")
+        return
+
+    try:
+        get_backend_pool(options["backends"])
+    except ValueError as e:
+        st.error(str(e))
+        return
+
+    if options["optimize"]:
+        if not payload:
+            st.error("Could not read a QR payload from the control image, scannability search needs one.")
+            return
+        queue_adaptive_sweep(prompts, list_of_params_to_run[0], enable_hr, path, out_dir, options, payload)
+        return
+
+    grid_size = len(list_of_params_to_run)
+    if options["budget"] and options["budget"] < grid_size:
+        list_of_params_to_run = list_of_params_to_run.sample(options["budget"], method=options["sampling"])
+    total_operations = len(prompts) * len(list_of_params_to_run) * options["repeats"]
+    if total_operations == 0:
+        return
+
+    # Queue the jobs, the background worker runs them and the sweep monitor polls for results
+    store, worker = get_job_queue()
+    jobs = build_jobs(prompts, list_of_params_to_run, enable_hr, path, options["seed"], options["repeats"])
+    settings = {key: options[key] for key in ("concurrency", "backends", "use_cache", "repeats")}
+    # Render the repeats of a combination in one request: as many at once as the VRAM budget allows, the rest as iterations
+    settings["max_batch"] = min(options["repeats"], max_batch_for_vram(options["vram_gb"], enable_hr))
+    settings["max_iter"] = -(-options["repeats"] // settings["max_batch"])
+    st.session_state["sweep_id"] = store.create_sweep(jobs, out_dir, path, settings, payload)
+    worker.notify()
+    st.write(f"Queued {total_operations} jobs ({len(list_of_params_to_run)} of {grid_size} parameter combinations per prompt)")
+
+@st.cache_resource
+def get_job_queue():
+    """Job store and its background worker, shared by every session and kept across reruns."""
+    from job_store import JobStore, JobWorker
+    from optimizer import is_scannable
+    store = JobStore()
+    worker = JobWorker(store, scan_factory=lambda payload: lambda job, image_path: is_scannable(image_path, payload, control_path=job.control_path))
+    worker.start()
+    return store, worker
+
+def show_sweep_monitor(recent_failures=20):
+    """Shows progress and the latest results of a queued sweep, polling while it runs."""
+    from backend_pool import get_backend_pool
+    store, worker = get_job_queue()
+    sweeps = store.sweeps()
+    if not sweeps:
+        return
+
+    st.subheader("Sweeps")
+    labels = {sweep["id"]: f"#{sweep['id']} {os.path.basename(sweep['out_dir'])} ({sweep['counts']['done']}/{sweep['counts']['total']} done)" for sweep in sweeps}
+    ids = list(labels)
+    selected = st.session_state.get("sweep_id", ids[0])
+    sweep_id = st.selectbox("Sweep", ids, index=ids.index(selected) if selected in ids else 0, format_func=labels.get)
+    st.session_state["sweep_id"] = sweep_id
+
+    counts = store.counts(sweep_id)
+    finished = counts["done"] + counts["failed"] + counts["cancelled"]
+    active = counts["pending"] + counts["running"] > 0
+    nodes = []
+    if active:
+        settings = store.sweep(sweep_id)["settings"]
+        pool = get_backend_pool(settings.get("backends"))
+        if worker.current_sweep == sweep_id:
+            nodes = pool.progress()
+    # Count the part of the running jobs the nodes already rendered
+    in_progress = min(sum(node["progress"] for node in nodes), counts["running"])
+    st.progress(min(100, int((finished + in_progress) / max(counts["total"], 1) * 100)))
+    status = f"{counts['done']} done, {counts['failed']} failed, {counts['running']} running, {counts['pending']} pending"
+    if counts["cancelled"]:
+        status += f", {counts['cancelled']} cancelled"
+    st.write(status)
+
+    if active:
+        eta = sweep_eta(store, sweep_id, counts, nodes, min(settings.get("concurrency", 2), pool.capacity))
+        if eta is not None:
+            st.write(f"About {format_duration(eta)} left")
+        if st.button("Cancel sweep", help="Interrupt the running jobs and drop the ones still queued"):
+            worker.cancel(sweep_id)
+            st.rerun()
+        st.dataframe(pool.status())
+        previews = [node for node in nodes if node["preview"]]
+        for column, node in zip(st.columns(max(len(previews), 1)), previews):
+            caption = node["url"] if node["steps"] is None else f"{node['url']} step {node['step']}/{node['steps']}"
+            column.image(base64.b64decode(node["preview"].split(",")[-1]), caption=caption)
+
+    if counts["failed"] and not active and st.button("Retry failed jobs"):
+        store.retry_failed(sweep_id)
+        worker.notify()
+        st.rerun()
+
+    if counts["failed"]:
+        with st.expander(f"Failed jobs ({counts['failed']})"):
+            for row in store.results(sweep_id, limit=recent_failures, status="failed"):
+                st.error(f"{row['prompt']} {row['params']}: {row['error']}")
+
+    show_gallery(store.sweep(sweep_id)["out_dir"], key=f"sweep_{sweep_id}")
+
+    if active:
+        # Poll the store, the worker keeps going whatever happens to this page
+        time.sleep(2)
+        st.rerun()
+
+    sweep = store.sweep(sweep_id)
+    if sweep["settings"].get("adaptive"):
+        show_search_summary(sweep)
+    if sweep["payload"] and counts["done"]:
+        show_ranking(sweep["out_dir"], sweep["payload"], counts["done"], sweep["control_path"])
+
+@st.cache_resource
+def get_metrics_server():
+    """Serves the pipeline metrics on /metrics when QR_METRICS_PORT is set."""
+    port = os.environ.get("QR_METRICS_PORT")
+    return start_http_server(int(port)) if port else None
+
+def show_metrics_panel():
+    """Sidebar summary of where sweep time goes, per pipeline stage."""
+    get_metrics_server()
+    with st.sidebar.expander("Pipeline metrics"):
+        rows = METRICS.summary()
+        if not rows:
+            st.write("No jobs recorded yet.")
+            return
+        st.dataframe(rows)
+        st.dataframe(METRICS.size_summary())
+        METRICS.flush()
+        st.download_button("Prometheus metrics", METRICS.prometheus_text(), file_name="metrics.prom", mime="text/plain")
+        if st.button("Reset metrics"):
+            METRICS.reset()
+            st.rerun()
+
+def sweep_eta(store, sweep_id, counts, nodes, concurrency):
+    """Seconds until a sweep is done, from its average job time and the progress of the running jobs."""
+    mean = store.mean_elapsed(sweep_id)
+    current = max((node["eta"] or 0.0 for node in nodes), default=None)
+    if mean is None:
+        return current
+    remaining = counts["pending"] + counts["running"] - sum(node["progress"] for node in nodes)
+    return max(remaining * mean / max(concurrency, 1), current or 0.0)
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m {seconds:02d}s" if minutes else f"{seconds}s"
+
+def show_ranking(out_dir, payload, done, control_path=None, limit=20):
+    """Ranks the images of a finished sweep by their module scannability score."""
+    st.subheader("Most scannable results")
+    ranking = rank_directory(out_dir, payload, done, control_path)[:limit]
+    st.dataframe([{"image": name, **score} for name, score in ranking])
+
+def queue_adaptive_sweep(prompts, base_params, enable_hr, path, out_dir, options, payload):
+    """Queues a search of the control weight per prompt until each prompt has enough scannable results."""
+    from optimizer import AdaptiveSweep
+    store, worker = get_job_queue()
+    adaptive_settings = {"prompts": list(prompts), "params": dict(base_params), "enable_hr": enable_hr,
+                         "seed": options["seed"], **{key: options[key] for key in ("min_weight", "max_weight", "target", "max_jobs")}}
+    # Only the first job of every prompt is stored, the worker queues the next one as each finishes
+    jobs = AdaptiveSweep.from_settings(adaptive_settings, path).first_jobs()
+    settings = {key: options[key] for key in ("concurrency", "backends", "use_cache")}
+    settings["adaptive"] = adaptive_settings
+    st.session_state["sweep_id"] = store.create_sweep(jobs, out_dir, path, settings, payload)
+    worker.notify()
+    st.write(f"Queued a search of up to {len(prompts) * options['max_jobs']} jobs for {options['target']} scannable results per prompt")
+
+def show_search_summary(sweep):
+    """One line per prompt of a scannability search with what it found."""
+    from optimizer import AdaptiveSweep
+    store, _ = get_job_queue()
+    adaptive = AdaptiveSweep.from_settings(sweep["settings"]["adaptive"], sweep["control_path"], store.finished(sweep["id"]))
+    for search in adaptive.searches.values():
+        best = "none" if search.best is None else search.best
+        st.write(f"{search.prompt}: {search.found} scannable of {search.jobs} jobs, lowest scannable weight {best}")
 
 # Main Function
 def main():
@@ -25,6 +373,7 @@ def main():
 
     menu = ["Home", "Generate QR Code", "Decode QR Code", "New AI QR", "About Us"]
     choice = st.sidebar.selectbox("Menu", menu)
+    show_metrics_panel()
 
     if choice == "Home":
         
@@ -53,105 +402,62 @@ Get started by choosing an option from the *menu on the left*, and let’s trans
     elif choice == "Generate QR Code":
         st.subheader("Generate a QR Code")
 
-        # Select input type
-        input_type = st.selectbox("Select the type of data for the QR code", ["Text", "URL", "Email", "WiFi", "Contact"])
-        qr_data = ""
-
         # Text, URL, Email, WiFi, or Contact input
-        if input_type == "Text":
-            qr_data = st.text_area("Enter the text to encode in the QR code")
-
-        elif input_type == "URL":
-            qr_data = st.text_input("Enter the URL to encode in the QR code")
-
-        elif input_type == "Email":
-            email = st.text_input("Enter the email address")
-            subject = st.text_input("Enter the subject")
-            body = st.text_area("Enter the email body")
-            qr_data = f"mailto:{email}?subject={subject}&body={body}"
-
-        elif input_type == "WiFi":
-            ssid = st.text_input("Enter the WiFi SSID")
-            password = st.text_input("Enter the WiFi Password")
-            encryption = st.selectbox("Select encryption type", ["WPA", "WEP", "None"])
-            qr_data = f"WIFI:T:{encryption};S:{ssid};P:{password};;"
-
-        elif input_type == "Contact":
-            st.subheader("Enter Contact Information")
-            full_name = st.text_input("Full Name")
-            organization = st.text_input("Organization")
-            address = st.text_input("Address")
-            phone = st.text_input("Phone")
-            email = st.text_input("Email")
-            notes = st.text_area("Notes")
-            
-            # Construct the vCard format
-            qr_data = (
-                f"BEGIN:VCARD\n"
-                f"VERSION:3.0\n"
-                f"N:{full_name}\n"
-                f"ORG:{organization}\n"
-                f"ADR:{address}\n"
-                f"TEL:{phone}\n"
-                f"EMAIL:{email}\n"
-                f"NOTE:{notes}\n"
-                f"END:VCARD"
-            )
+        qr_data = qr_data_inputs()
 
         # QR code customization options
         st.subheader("Customization Options")
         color = st.color_picker("Pick a color for the QR code", "#000000")
+        col1, col2 = st.columns(2)
+        output_format = col1.radio("Format", ["PNG", "SVG"], horizontal=True,
+                                   help="SVG stays sharp at any print size and is a fraction of a large PNG")
+        output_size = col2.selectbox("Size", ["Thumbnail", "Screen", "Print"], index=1,
+                                     help="Side of about 128, 512 or 2048 pixels")
 
         if st.button("Generate QR Code"):
             if qr_data:
-                qr = qrcode.QRCode(
-                    version=1,
-                    error_correction=qrcode.constants.ERROR_CORRECT_M,
-                    box_size=10,
-                    border=4,
-                )
-                qr.add_data(qr_data)
-                qr.make(fit=True)
-
-                # Generate the QR code image with custom color
-                img = qr.make_image(fill_color=color, back_color="white")
-                qr_code_bytes = io.BytesIO()
-                img.save(qr_code_bytes, format='PNG')
-                
-                st.image(qr_code_bytes.getvalue(), use_container_width=True)
+                # The preview and the download come from the same matrix
+                fmt, size = output_format.lower(), output_size.lower()
+                outputs = qr_outputs(qr_data, color=color, formats=tuple(sorted({"png", fmt})),
+                                     sizes=tuple(sorted({"screen", size})))
+
+                st.image(outputs["screen", "png"], use_container_width=True)
 
                 # Provide option to download QR code
-                st.download_button(label="Download QR Code", data=qr_code_bytes.getvalue(), file_name="qrcode.png", mime="image/png")
+                from qrgen import OUTPUT_FORMATS
+                data = outputs[size, fmt]
+                st.caption(f"{output_format}, {output_size.lower()} size: {len(data) / 1024:.1f} KB")
+                st.download_button(label="Download QR Code", data=data, file_name=f"qrcode_{size}.{fmt}",
+                                   mime=OUTPUT_FORMATS[fmt])
             else:
                 st.error("Please provide data to generate the QR code.")
 
     elif choice == "Decode QR Code":
         st.subheader("Decode a QR Code")
 
-        img_file = st.file_uploader("Upload a QR Code Image", type=['png', 'jpg', 'jpeg'])
+        img_files = st.file_uploader("Upload QR Code Images or a ZIP archive of them", type=['png', 'jpg', 'jpeg', 'zip'], accept_multiple_files=True)
         
-        if img_file is not None:
-            # Load the image
-            image = Image.open(img_file)
-
-            # Convert image to numpy array for OpenCV
-            img_array = np.array(image)
-
-            # Decode using pyzbar
-            decoded_data = decode(img_array)
-            if decoded_data:
-                for obj in decoded_data:
-                    decoded_text = obj.data.decode('utf-8')
-                    st.success(f"Decoded Data: {decoded_text}")
-                    st.image(image, use_container_width=True)
+        if img_files:
+            # Decode every image (and every image inside a ZIP) across a process pool
+            results = decode_files(tuple((img_file.name, img_file.getvalue()) for img_file in img_files))
+
+            if len(results) == 1 and len(img_files) == 1 and not img_files[0].name.lower().endswith(".zip"):
+                if results[0]["data"]:
+                    for decoded_text in results[0]["data"]:
+                        st.success(f"Decoded Data: {decoded_text}")
+                    st.image(img_files[0], use_container_width=True)
+                else:
+                    st.error("No valid QR code found in the image.")
             else:
-                st.error("No valid QR code found in the image.")
+                found = sum(1 for row in results if row["data"])
+                st.write(f"Decoded {found} of {len(results)} images")
+                st.dataframe([{**row, "data": " | ".join(row["data"])} for row in results], use_container_width=True)
 
     elif choice == "New AI QR":
         
         # Create a list to store prompts
         if 'prompts' not in st.session_state:
-            st.session_state['prompts'] = ["Undersea marine life", "NYC skyline", "Amazon Rainforest", "Anime sword battle"]
+            st.session_state['prompts'] = list(DEFAULT_PROMPTS)
 
         # Define Prompts
         st.title("Prompts")
@@ -177,73 +483,23 @@ Get started by choosing an option from the *menu on the left*, and let’s trans
         if selected_option == 'Generate a QR':
             st.subheader("Generate a QR Code")
 
-            # Select input type
-            input_type = st.selectbox("Select the type of data for the QR code", ["Text", "URL", "Email", "WiFi", "Contact"])
-            qr_data = ""
-
-            if input_type == "Text":
-                qr_data = st.text_area("Enter the text to encode in the QR code")
-
-            elif input_type == "URL":
-                qr_data = st.text_input("Enter the URL to encode in the QR code")
-
-            elif input_type == "Email":
-                email = st.text_input("Enter the email address")
-                subject = st.text_input("Enter the subject")
-                body = st.text_area("Enter the email body")
-                qr_data = f"mailto:{email}?subject={subject}&body={body}"
-
-            elif input_type == "WiFi":
-                ssid = st.text_input("Enter the WiFi SSID")
-                password = st.text_input("Enter the WiFi Password")
-                encryption = st.selectbox("Select encryption type", ["WPA", "WEP", "None"])
-                qr_data = f"WIFI:T:{encryption};S:{ssid};P:{password};;"
-
-            elif input_type == "Contact":
-                st.subheader("Enter Contact Information")
-                full_name = st.text_input("Full Name")
-                organization = st.text_input("Organization")
-                address = st.text_input("Address")
-                phone = st.text_input("Phone")
-                email = st.text_input("Email")
-                notes = st.text_area("Notes")
-
-                # Construct vCard format
-                qr_data = (
-                    f"BEGIN:VCARD\n"
-                    f"VERSION:3.0\n"
-                    f"N:{full_name}\n"
-                    f"ORG:{organization}\n"
-                    f"ADR:{address}\n"
-                    f"TEL:{phone}\n"
-                    f"EMAIL:{email}\n"
-                    f"NOTE:{notes}\n"
-                    f"END:VCARD"
-                )
-
-            
+            qr_data = qr_data_inputs()
+            control_settings = control_image_options()
 
             if st.button("Generate QR Code"):
                 if qr_data:
-                    qr = qrcode.QRCode(
-                        version=1,
-                        error_correction=qrcode.constants.ERROR_CORRECT_M,
-                        box_size=10,
-                        border=4,
-                    )
-                    qr.add_data(qr_data)
-                    qr.make(fit=True)
-
-                    # Store QR code in memory (BytesIO)
-                    qr_code_bytes = io.BytesIO()
-                    img = qr.make_image(back_color="white")
-                    img.save(qr_code_bytes, format='PNG')
-
+                    try:
+                        control_png, control_info = control_image(qr_data, **control_settings)
+                    except ValueError as e:
+                        st.error(str(e))
+                        st.stop()
                     # Store in session_state to persist after button click
-                    st.session_state.qr_image = qr_code_bytes.getvalue()
+                    st.session_state.qr_image = control_png
+                    st.session_state.qr_data = qr_data
 
                     # Display the generated QR Code
                     st.image(st.session_state.qr_image, use_container_width=True)
+                    st.write(control_info)
 
                     # Provide download button
                     st.download_button(label="Download QR Code", data=st.session_state.qr_image, file_name="qrcode.png", mime="image/png")
@@ -260,61 +516,25 @@ Get started by choosing an option from the *menu on the left*, and let’s trans
                 st_ending_control_step = st.text_input("Ending Control Step", value="1", help="Values between 0.00-1.00")
                 st_enable_hr = st.checkbox("Enable High Resolution")
                 st_hr_steps = st.text_input("Hi Res Steps", value="0", help="Values between 1-150")
+                sweep_settings = sweep_options()
 
                 if st.button("Start AI Processing"):
-                    ai_input_image = Image.open(io.BytesIO(st.session_state.qr_image))
-
-                    fake = Faker()
-                    random_subdirectory_name = f"{fake.word()}"
+                    random_subdirectory_name = f"{get_faker().word()}"
                     st.write(f"Images will be saved to the folder `{random_subdirectory_name}`")
                     random_subdirectory_path = os.path.join(os.getcwd(), 'C:/Work/Project/Major/qr/control-net-hacking-main/control-net-hacking-main/images', random_subdirectory_name)
                     os.makedirs(random_subdirectory_path)
 
                     starting_image_path = os.path.join(random_subdirectory_path, "_starting_image.png")
 
-                    # Save the QR Code for AI Processing
-                    ai_input_image.save(starting_image_path)
+                    # Save the QR Code for AI Processing, the PNG bytes are written as they are
+                    with open(starting_image_path, "wb") as f:
+                        f.write(st.session_state.qr_image)
 
                     path = starting_image_path
                     prompts = st.session_state['prompts']
 
-                    total_operations = len(st.session_state['prompts'])
-                    operations_completed = 0
-
-                    my_bar = st.progress(0)
-
-                    for index, prompt in enumerate(prompts):
-                        params_to_combine = {'steps': st_steps, "weight": st_control_weight, "guidance_start": st_starting_control_step, "guidance_end": st_ending_control_step, "hr_second_pass_steps": st_hr_steps}
-
-                        list_of_params_to_run = split_and_combine(params_to_combine)
-                        for index_2, params in enumerate(list_of_params_to_run):
-                            control_net = ControlnetRequest(prompt, path)
-                            control_net.build_body()
-                            control_net.update_sd({
-                                "steps": int(params["steps"]),
-                                "enable_hr": st_enable_hr,
-                                "hr_second_pass_steps": int(params["hr_second_pass_steps"])}
-                            )
-                            control_net.update_cn({
-                                "weight": float(params["weight"]),
-                                "guidance_start": float(params["guidance_start"]),
-                                "guidance_end": float(params["guidance_end"])
-                            })
-                            output = control_net.send_request()
-                            result = output['images'][0]
-
-                            image = Image.open(io.BytesIO(base64.b64decode(result.split(",", 1)[0])))
-                            gen_image_path = os.path.join(random_subdirectory_path, f"gen_image_{index}_{index_2}.png")
-                            image.save(gen_image_path)
-
-                            st.write(prompt)
-                            st.write(params)
-                            st.image(gen_image_path)
-
-                            # Update progress bar
-                            operations_completed += 1
-                            progress_percent = int((operations_completed / total_operations) * 100)
-                            my_bar.progress(progress_percent)
+                    params_to_combine = {'steps': st_steps, "weight": st_control_weight, "guidance_start": st_starting_control_step, "guidance_end": st_ending_control_step, "hr_second_pass_steps": st_hr_steps}
+                    run_sweep(prompts, params_to_combine, st_enable_hr, path, random_subdirectory_path, sweep_settings, st.session_state.get('qr_data'))
         
         else:
             # Upload Image and Run
@@ -326,7 +546,7 @@ Get started by choosing an option from the *menu on the left*, and let’s trans
                 st.image(uploaded_file, caption="Uploaded Image.", use_container_width=True)
 
                 # Parameters to use
-                st.write("Enter numerical values for the following parameter. Use a comma if you would like to permutate over multiple values")
+                st.write("Enter numerical values for the following parameter. Use a comma if you would like to permutate over multiple values, or start:stop:step for a range")
                 st_steps = st.text_input("Steps", value=20, help="Values between 1-150")
                 st_control_weight = st.text_input("Control weight", value=1, help="Values between 0.00-2.00")
                 st_starting_control_step = st.text_input("Starting Control Step", value = "0", help="Values between 0.00-1.00")
@@ -336,10 +556,11 @@ Get started by choosing an option from the *menu on the left*, and let’s trans
                     st_hr_steps = st.text_input("Hi Res Steps", value="0", help="Values between 1 and 150, Enter 0 to have the same steps as sampler")
                 else:
                     st_hr_steps = '0'
+                sweep_settings = sweep_options()
 
                 if st.button("Start Processing"):
-                    fake = Faker()
-                    random_subdirectory_name = f"{fake.word()}"
+                    from optimizer import decode_payloads
+                    random_subdirectory_name = f"{get_faker().word()}"
                     st.write(f"Images will be saved to the folder `{random_subdirectory_name}`")
                     random_subdirectory_path = os.path.join(os.getcwd(),'C:/Work/Project/Major/qr/control-net-hacking-main/control-net-hacking-main/images', random_subdirectory_name)
                     os.makedirs(random_subdirectory_path)
@@ -354,46 +575,12 @@ Get started by choosing an option from the *menu on the left*, and let’s trans
         
                     prompts = st.session_state['prompts']
 
-                    total_operations = len(st.session_state['prompts'])
-                    operations_completed = 0
-
-                    progress_text = "Operation in progress. Please wait."
-                    my_bar = st.progress(0)
-
-                    for index, prompt in enumerate(prompts):
-                        params_to_combine = {'steps': st_steps, "weight": st_control_weight,"guidance_start": st_starting_control_step, "guidance_end": st_ending_control_step, "hr_second_pass_steps":st_hr_steps}
-            
-                        list_of_params_to_run = split_and_combine(params_to_combine)
-                        for index_2, params in enumerate(list_of_params_to_run):
-
-                            control_net = ControlnetRequest(prompt, path)
-                            control_net.build_body()
-                            control_net.update_sd({
-                                "steps": int(params["steps"]),
-                                "enable_hr": st_enable_hr,
-                                "hr_second_pass_steps": int(params["hr_second_pass_steps"])}
-                                )
-                            control_net.update_cn({
-                                    "weight": float(params["weight"]),
-                                    "guidance_start": float(params["guidance_start"]),
-                                    "guidance_end": float(params["guidance_end"])
-                                }   
-                            )
-                            output = control_net.send_request()
-                            result = output['images'][0]
-
-                            image = Image.open(io.BytesIO(base64.b64decode(result.split(",", 1)[0])))
-                            gen_image_path = os.path.join(random_subdirectory_path, f"gen_image_{index}_{index_2}.png")
-                            image.save(gen_image_path)
-
-                            st.write(prompt)
-                            st.write(params)
-                            st.image(gen_image_path)
-                
-                        # Update the progress bar
-                        operations_completed += 1
-                        progress_percent = int((operations_completed / total_operations) * 100)
-                        my_bar.progress(progress_percent)
+                    params_to_combine = {'steps': st_steps, "weight": st_control_weight,"guidance_start": st_starting_control_step, "guidance_end": st_ending_control_step, "hr_second_pass_steps":st_hr_steps}
+                    payloads = decode_payloads(path)
+                    run_sweep(prompts, params_to_combine, st_enable_hr, path, random_subdirectory_path, sweep_settings, payloads[0] if payloads else None)
+
+        # Queued sweeps keep running across reruns, show how they are doing
+        show_sweep_monitor()
 
     else:
         st.subheader(" **About Our Project**")
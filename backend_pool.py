@@ -0,0 +1,396 @@
+import os
+import threading
+import time
+
+import requests
+
+from transport import DEFAULT_BASE_URL, Transport
+
+"""
+    Scheduler for several automatic1111 GPU nodes.
+
+    A BackendPool can be passed anywhere a Transport is expected (for example
+    ControlnetRequest or SweepExecutor). Every txt2img post is routed to the
+    least loaded healthy node that has the requested ControlNet model. A job
+    that fails on one node is retried on another. A node is only taken out of
+    rotation after MAX_FAILURES requests in a row could not reach it or timed
+    out, until a health check passes again: an error the node answers with
+    (a CUDA out of memory 500, say) belongs to the job, not to the node. Jobs
+    that no node in rotation can run wait for a node to pass its health check,
+    which is retried every RECHECK_INTERVAL seconds meanwhile.
+
+    Jobs are routed to nodes that already have the body's checkpoint loaded
+    when there is a choice. Only a checkpoint configured for the pool (the
+    A1111_CHECKPOINT environment variable) is ever loaded onto the nodes.
+
+    Backends are configured one per line (or comma separated) as
+        url [concurrency] [weight]
+    for example "http://gpu1:7860 2 1.5", or through the A1111_BACKENDS
+    environment variable.
+
+    While jobs run, progress() polls /sdapi/v1/progress on every busy node
+    for its step count, ETA and live preview. The webui can only interrupt
+    whatever a node is running, so several executors sharing one pool each
+    send their requests through their own client() view: its interrupt()
+    only reaches the nodes that are working on that client's requests alone.
+"""
+
+DEFAULT_BACKENDS = os.environ.get("A1111_BACKENDS", DEFAULT_BASE_URL)
+# Checkpoint every node is asked to load for txt2img jobs, unset leaves the nodes' own
+DEFAULT_CHECKPOINT = os.environ.get("A1111_CHECKPOINT") or None
+
+OPTIONS_PATH = "/sdapi/v1/options"
+CONTROLNET_MODELS_PATH = "/controlnet/model_list"
+PROGRESS_PATH = "/sdapi/v1/progress"
+INTERRUPT_PATH = "/sdapi/v1/interrupt"
+
+HEALTH_TIMEOUT = (3, 10)
+
+# Consecutive failed requests after which a node is taken out of rotation
+MAX_FAILURES = 3
+
+# Seconds between health checks of nodes out of rotation while jobs wait for one to come back
+RECHECK_INTERVAL = 2.0
+
+
+class NoBackendAvailable(RuntimeError):
+    pass
+
+
+class Backend:
+    def __init__(self, url, concurrency=2, weight=1.0):
+        self.transport = Transport(url, pool_size=max(concurrency * 2, 4))
+        self.url = self.transport.base_url
+        self.concurrency = max(1, int(concurrency))
+        self.weight = max(float(weight), 0.01)
+        self.in_flight = 0
+        # Requests in flight per owner (a PoolClient, or None for direct calls)
+        self.owners = {}
+        self.healthy = None
+        self.checked_at = 0.0
+        # Consecutive requests that could not reach the node or timed out
+        self.failures = 0
+        # Set while a health check of the node is running
+        self.checking = False
+        # Loaded checkpoint and installed ControlNet models, as reported by the node
+        self.checkpoint = None
+        self.controlnet_models = None
+
+    @property
+    def load(self):
+        return (self.in_flight + 1) / self.weight
+
+    def check(self):
+        """Health checks the node through the API and refreshes its model state."""
+        try:
+            options = self.transport.get(OPTIONS_PATH, timeout=HEALTH_TIMEOUT).json()
+            self.checkpoint = options.get("sd_model_checkpoint")
+            try:
+                models = self.transport.get(CONTROLNET_MODELS_PATH, timeout=HEALTH_TIMEOUT).json()
+                self.controlnet_models = set(models.get("model_list", []))
+            except (requests.RequestException, ValueError):
+                # Extension API missing, do not filter on models
+                self.controlnet_models = None
+            self.healthy = True
+            self.failures = 0
+        except (requests.RequestException, ValueError):
+            self.healthy = False
+        self.checked_at = time.monotonic()
+        return self.healthy
+
+    def progress(self, previews=True):
+        """The node's /sdapi/v1/progress answer, or None if it could not be read."""
+        try:
+            params = {"skip_current_image": "false" if previews else "true"}
+            return self.transport.get(PROGRESS_PATH, params=params, timeout=HEALTH_TIMEOUT).json()
+        except (requests.RequestException, ValueError):
+            return None
+
+    def interrupt(self):
+        """Stops the job the node is running, it answers with the image rendered so far."""
+        try:
+            self.transport.post(INTERRUPT_PATH, timeout=HEALTH_TIMEOUT)
+            return True
+        except requests.RequestException:
+            return False
+
+    def has_controlnet_model(self, model):
+        return not model or self.controlnet_models is None or model in self.controlnet_models
+
+    def has_checkpoint(self, name, model_hash):
+        if not name or not self.checkpoint:
+            return True
+        return (model_hash and model_hash in self.checkpoint) or self.checkpoint.startswith(name)
+
+    def __repr__(self):
+        return f"Backend({self.url!r}, concurrency={self.concurrency}, weight={self.weight})"
+
+
+def parse_backends(spec):
+    """Parses 'url [concurrency] [weight]' entries separated by new lines or commas."""
+    backends = []
+    for entry in spec.replace(",", "\n").splitlines():
+        parts = entry.split()
+        if not parts:
+            continue
+        try:
+            if len(parts) > 3:
+                raise ValueError
+            concurrency = int(parts[1]) if len(parts) > 1 else 2
+            weight = float(parts[2]) if len(parts) > 2 else 1.0
+        except ValueError:
+            raise ValueError(f"Invalid backend '{entry.strip()}', expected 'url [concurrency] [weight]'")
+        backends.append(Backend(parts[0], concurrency, weight))
+    if not backends:
+        raise ValueError("At least one automatic1111 backend URL is required")
+    return backends
+
+
+class BackendPool:
+    def __init__(self, backends, health_interval=30.0, acquire_timeout=600.0, checkpoint=DEFAULT_CHECKPOINT):
+        self.backends = list(backends)
+        self.checkpoint = checkpoint
+        self.health_interval = health_interval
+        self.acquire_timeout = acquire_timeout
+        self._cond = threading.Condition()
+
+    @property
+    def base_url(self):
+        return self.backends[0].url
+
+    @property
+    def capacity(self):
+        return sum(backend.concurrency for backend in self.backends)
+
+    def url(self, path):
+        return self.backends[0].transport.url(path)
+
+    def _due(self, backend, now, recheck):
+        if backend.checking:
+            return False
+        if backend.healthy is None:
+            return True
+        interval = RECHECK_INTERVAL if recheck and not backend.healthy else self.health_interval
+        return now - backend.checked_at > interval
+
+    def _refresh(self, recheck=False):
+        """
+        Health checks the nodes that are due: new ones and every node last checked more
+        than health_interval ago, healthy ones included so their model lists stay current.
+        With recheck, nodes out of rotation are due every RECHECK_INTERVAL instead.
+        Each node is claimed under the lock and checked without it, so a node that does
+        not answer delays only the thread checking it while others check the rest.
+        """
+        while True:
+            now = time.monotonic()
+            with self._cond:
+                backend = next((backend for backend in self.backends if self._due(backend, now, recheck)), None)
+                if backend is None:
+                    return
+                backend.checking = True
+            try:
+                backend.check()
+            finally:
+                with self._cond:
+                    backend.checking = False
+                    self._cond.notify_all()
+
+    def _candidates(self, body, exclude):
+        cn_model = None
+        if body:
+            try:
+                cn_model = body["alwayson_scripts"]["controlnet"]["args"][0].get("model")
+            except (KeyError, IndexError, TypeError):
+                pass
+        return [
+            backend for backend in self.backends
+            if backend.healthy and backend not in exclude and backend.has_controlnet_model(cn_model)
+        ]
+
+    def acquire(self, body=None, exclude=(), owner=None):
+        """
+        Reserves the least loaded healthy node able to run body, waiting while all are busy
+        or, re-checking them, while every node that could run it is out of rotation.
+        """
+        deadline = time.monotonic() + self.acquire_timeout
+        waiting = False
+        while True:
+            self._refresh(recheck=waiting)
+            with self._cond:
+                candidates = self._candidates(body, exclude)
+                if not candidates:
+                    # Only nodes out of rotation (or still being checked) may turn out to be usable
+                    if all(backend.healthy or backend in exclude for backend in self.backends):
+                        raise NoBackendAvailable("No healthy automatic1111 backend can run this job")
+                    waiting = True
+                free = [backend for backend in candidates if backend.in_flight < backend.concurrency]
+                if free:
+                    name, model_hash = self._checkpoint_of(body)
+                    # Prefer nodes that already have the checkpoint loaded, then the lightest load
+                    backend = min(free, key=lambda b: (not b.has_checkpoint(name, model_hash), b.load))
+                    backend.in_flight += 1
+                    backend.owners[owner] = backend.owners.get(owner, 0) + 1
+                    return backend
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    state = "healthy" if waiting else "free"
+                    raise NoBackendAvailable(f"Timed out waiting for a {state} automatic1111 backend")
+                self._cond.wait(min(remaining, RECHECK_INTERVAL if waiting else self.health_interval))
+
+    def release(self, backend, ok=True, owner=None):
+        """Returns a node reserved by acquire(). ok=False counts a request that did not reach it."""
+        with self._cond:
+            backend.in_flight -= 1
+            backend.owners[owner] -= 1
+            if not backend.owners[owner]:
+                del backend.owners[owner]
+            if ok:
+                backend.failures = 0
+            else:
+                backend.failures += 1
+                if backend.failures >= MAX_FAILURES:
+                    backend.healthy = False
+                    backend.checked_at = time.monotonic()
+            self._cond.notify_all()
+
+    def _checkpoint_of(self, body):
+        """(name, hash) of the checkpoint body should run on, the pool's own if one is configured."""
+        if self.checkpoint:
+            return self.checkpoint, None
+        if not body:
+            return None, None
+        return body.get("sd_model_name"), body.get("sd_model_hash")
+
+    def _pin_models(self, body):
+        """Asks the node to load the pool's configured checkpoint, if there is one."""
+        if not self.checkpoint:
+            return body
+        body = dict(body)
+        body["override_settings"] = {**body.get("override_settings", {}), "sd_model_checkpoint": self.checkpoint}
+        # Keep it loaded for the next job instead of switching back
+        body["override_settings_restore_afterwards"] = False
+        return body
+
+    def get(self, path, owner=None, **kwargs):
+        backend = self.acquire(owner=owner)
+        try:
+            response = backend.transport.get(path, **kwargs)
+        except requests.RequestException:
+            self.release(backend, ok=False, owner=owner)
+            raise
+        self.release(backend, owner=owner)
+        return response
+
+    def post(self, path, json=None, owner=None, **kwargs):
+        """Posts to the best node, moving the request to another node if it fails or times out."""
+        tried = []
+        last_error = None
+        while True:
+            try:
+                backend = self.acquire(json, exclude=tried, owner=owner)
+            except NoBackendAvailable:
+                if last_error is not None:
+                    raise last_error
+                raise
+            body = self._pin_models(json) if json else json
+            try:
+                response = backend.transport.post(path, json=body, **kwargs)
+            except requests.HTTPError as e:
+                # The node answered, so it stays in rotation
+                self.release(backend, owner=owner)
+                if e.response is not None and e.response.status_code < 500:
+                    # The request itself is bad, another node will not do better
+                    raise
+                tried.append(backend)
+                last_error = e
+                continue
+            except requests.RequestException as e:
+                self.release(backend, ok=False, owner=owner)
+                tried.append(backend)
+                last_error = e
+                continue
+            if json and self.checkpoint:
+                backend.checkpoint = self.checkpoint
+            self.release(backend, owner=owner)
+            return response
+
+    def progress(self, previews=True):
+        """One row per busy node with the progress (0-1), ETA and live preview of its current job."""
+        rows = []
+        for backend in self.backends:
+            if not backend.in_flight or not backend.healthy:
+                continue
+            answer = backend.progress(previews)
+            if answer is None:
+                continue
+            state = answer.get("state") or {}
+            rows.append({"url": backend.url, "progress": answer.get("progress") or 0.0,
+                         "eta": answer.get("eta_relative"), "step": state.get("sampling_step"),
+                         "steps": state.get("sampling_steps"), "preview": answer.get("current_image")})
+        return rows
+
+    def interrupt(self, owner=None):
+        """
+        Interrupts the current job on every busy node, or with an owner on the nodes whose
+        requests in flight all belong to it. Returns the urls of the nodes reached.
+        """
+        with self._cond:
+            busy = [backend for backend in self.backends if backend.in_flight
+                    and (owner is None or set(backend.owners) == {owner})]
+        return [backend.url for backend in busy if backend.interrupt()]
+
+    def client(self):
+        """A view of the pool whose requests interrupt() can tell apart from everyone else's."""
+        return PoolClient(self)
+
+    def status(self):
+        """One row per node for display."""
+        return [
+            {"url": backend.url, "healthy": backend.healthy, "in_flight": backend.in_flight,
+             "concurrency": backend.concurrency, "weight": backend.weight,
+             "failures": backend.failures, "checkpoint": backend.checkpoint}
+            for backend in self.backends
+        ]
+
+
+class PoolClient:
+    """Transport over a shared BackendPool that tags its requests, see BackendPool.client()."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @property
+    def base_url(self):
+        return self.pool.base_url
+
+    @property
+    def capacity(self):
+        return self.pool.capacity
+
+    def url(self, path):
+        return self.pool.url(path)
+
+    def get(self, path, **kwargs):
+        return self.pool.get(path, owner=self, **kwargs)
+
+    def post(self, path, json=None, **kwargs):
+        return self.pool.post(path, json=json, owner=self, **kwargs)
+
+    def interrupt(self):
+        """Interrupts the nodes working only on this client's requests."""
+        return self.pool.interrupt(owner=self)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_backend_pool(spec=None):
+    """Returns the shared BackendPool for a backend spec, creating it on first use."""
+    key = (spec or DEFAULT_BACKENDS).strip()
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = BackendPool(parse_backends(key))
+            _pools[key] = pool
+        return pool
@@ -0,0 +1,162 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from payloads import PAYLOAD_BUILDERS, build_payload
+from qrgen import render_png
+
+"""
+    Headless bulk QR generation.
+
+    Rows are streamed from a CSV or JSONL file, rendered across a process pool
+    and written as PNG files to a directory or into a single ZIP. Only a small
+    window of rows is in flight at any time, so memory use does not grow with
+    the size of the input.
+
+    Every row needs the fields of its QR type (see payloads.PAYLOAD_BUILDERS),
+    for example:
+        type,ssid,password,encryption
+        WiFi,Office,hunter2,WPA
+    An optional "filename" column names the output, otherwise rows are numbered.
+    Directories in it are dropped and repeated names get a numeric suffix, so
+    every row lands in its own file inside the output directory or ZIP.
+
+    Usage:
+        python batch.py staff.csv --type Contact --out cards/
+        python batch.py items.jsonl --type URL --zip items.zip --workers 8
+"""
+
+
+def read_rows(path):
+    """Yields one dict per input row, CSV or JSONL depending on the extension."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def output_name(index, filename=None):
+    """The file name of a row: its filename column without any directories, or its number."""
+    name = os.path.basename((filename or "").replace("\\", "/")).strip()
+    if name in ("", ".", ".."):
+        name = f"qr_{index:06d}"
+    if not name.lower().endswith(".png"):
+        name += ".png"
+    return name
+
+
+def unique_name(name, used):
+    """name, or name with the lowest free "_<n>" suffix if a previous row took it. Adds it to used."""
+    stem, ext = os.path.splitext(name)
+    candidate, suffix = name, 1
+    # Case-insensitive, as the output directory may be on such a file system
+    while candidate.lower() in used:
+        candidate = f"{stem}_{suffix}{ext}"
+        suffix += 1
+    used.add(candidate.lower())
+    return candidate
+
+
+def render_row(job):
+    """Renders one (index, row, default_type, color) job. Runs in a worker process."""
+    index, row, default_type, color = job
+    name = output_name(index, row.get("filename"))
+    try:
+        payload = build_payload(row.get("type") or default_type, row)
+        return index, name, render_png(payload, color=row.get("color") or color), None
+    except Exception as e:
+        return index, name, None, str(e)
+
+
+def render_rows(rows, default_type, color="black", workers=None, window=None):
+    """Yields (index, file name, png bytes, error) in input order."""
+    workers = workers or os.cpu_count() or 1
+    window = window or workers * 8
+    pending = deque()
+    with ProcessPoolExecutor(workers) as pool:
+        for index, row in enumerate(rows):
+            pending.append(pool.submit(render_row, (index, row, default_type, color)))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class DirectoryWriter:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, name, data):
+        with open(os.path.join(self.path, name), "wb") as f:
+            f.write(data)
+
+    def close(self):
+        pass
+
+
+class ZipWriter:
+    def __init__(self, path):
+        # PNG is already compressed, storing avoids a pointless deflate pass
+        self.zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED)
+
+    def write(self, name, data):
+        self.zip.writestr(name, data)
+
+    def close(self):
+        self.zip.close()
+
+
+def run(rows, writer, default_type, color="black", workers=None, progress_every=500, log=sys.stderr):
+    """Renders rows into writer and returns (written, failed) counts."""
+    written = failed = 0
+    used = set()
+    started = time.perf_counter()
+    for index, name, data, error in render_rows(rows, default_type, color, workers):
+        if error is None:
+            writer.write(unique_name(name, used), data)
+            written += 1
+        else:
+            failed += 1
+            print(f"row {index}: {error}", file=log)
+        done = written + failed
+        if log and progress_every and done % progress_every == 0:
+            rate = done / (time.perf_counter() - started)
+            print(f"{done} rows, {failed} failed, {rate:.0f} codes/s", file=log)
+    return written, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk QR code generation from CSV or JSONL")
+    parser.add_argument("input", help="CSV or JSONL file with one QR code per row")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--out", help="directory to write PNG files to")
+    output.add_argument("--zip", help="ZIP file to write PNG files to")
+    parser.add_argument("--type", default="Text", choices=list(PAYLOAD_BUILDERS),
+                        help="QR type for rows without a 'type' column")
+    parser.add_argument("--color", default="black", help="fill color for rows without a 'color' column")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    writer = ZipWriter(args.zip) if args.zip else DirectoryWriter(args.out)
+    started = time.perf_counter()
+    try:
+        written, failed = run(read_rows(args.input), writer, args.type, args.color, args.workers)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {written} QR codes ({failed} failed) in {elapsed:.1f}s", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
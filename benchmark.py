@@ -0,0 +1,315 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from mock_a1111 import MockA1111, MockSettings, parse_size
+
+"""
+    Throughput benchmarks for the generation pipeline.
+
+    Sweep scenarios run against a local mock webui (mock_a1111.py) unless --url
+    points at a real one, over every combination of grid size, concurrency,
+    hires.fix on / off and result cache state:
+    - off:  no ResultCache
+    - cold: an empty ResultCache, every job renders and is stored
+    - warm: the same sweep was run once already, every job is a cache hit
+    The "request" path sends the jobs one by one through
+    ControlnetRequest.send_request as a baseline for the pipelined "sweep" path.
+    Each scenario runs in a fresh process so peak RSS and the control image
+    cache are per scenario.
+
+    Microbenchmarks time split_and_combine, QR rendering and pyzbar decoding.
+
+    Reports jobs/s, p50 / p99 job latency and peak RSS. --json saves a report
+    tagged with the git commit, --compare prints the change against a saved one.
+
+    Usage:
+        python benchmark.py --grid 8,32 --concurrency 1,4,8 --json before.json
+        python benchmark.py --grid 8,32 --concurrency 1,4,8 --compare before.json
+"""
+
+PROMPT = "a medieval village market, highly detailed"
+CONTROL_DATA = "https://example.com/benchmark"
+BASE_SEED = 1234
+
+# Parameter grid used by the split_and_combine microbenchmark, 13454 combinations
+MICRO_GRID = {
+    "steps": "10:40:1",
+    "weight": "0.5:2.0:0.05",
+    "guidance_start": "0,0.1",
+    "guidance_end": "0.6:0.9:0.05",
+    "hr_second_pass_steps": "10",
+}
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def peak_rss_mb():
+    # ru_maxrss survives fork + exec, so a spawned child would report its parent's
+    # peak; VmHWM is reset on exec and only covers this process
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def scenario_params(grid_size):
+    """A parameter grid of exactly grid_size combinations."""
+    return {
+        "steps": ",".join(str(10 + i) for i in range(grid_size)),
+        "weight": "1.25",
+        "guidance_start": "0",
+        "guidance_end": "0.75",
+        "hr_second_pass_steps": "10",
+    }
+
+
+def run_scenario(scenario):
+    """Runs one sweep scenario and returns its report row. Meant to run in a fresh process."""
+    from metrics import METRICS
+    from qrgen import render_png
+    from result_cache import ResultCache
+    from sweep import SweepExecutor, build_jobs, build_request
+    from transport import Transport
+    from utils import ParamGrid
+
+    with tempfile.TemporaryDirectory() as tmp:
+        control_path = os.path.join(tmp, "control.png")
+        with open(control_path, "wb") as f:
+            f.write(render_png(CONTROL_DATA))
+        out_dir = os.path.join(tmp, "out")
+        os.makedirs(out_dir)
+
+        concurrency = scenario["concurrency"]
+        transport = Transport(scenario["url"], pool_size=max(concurrency * 2, 4))
+        cache = ResultCache(os.path.join(tmp, "cache")) if scenario["cache"] != "off" else None
+        params = list(ParamGrid(scenario_params(scenario["grid"])))
+
+        def jobs():
+            return build_jobs([PROMPT], params, scenario["hr"], control_path, BASE_SEED)
+
+        def run_sweep():
+            executor = SweepExecutor(http_workers=concurrency, io_workers=concurrency, transport=transport,
+                                     cache=cache)
+            return [(result.elapsed, result.ok, result.cached) for result in executor.run(jobs(), out_dir)]
+
+        def run_requests():
+            results = []
+            for job in jobs():
+                started = time.perf_counter()
+                try:
+                    build_request(job, transport).send_request()
+                    ok = True
+                except Exception:
+                    ok = False
+                results.append((time.perf_counter() - started, ok, False))
+            return results
+
+        run = run_sweep if scenario["path"] == "sweep" else run_requests
+        if scenario["cache"] == "warm":
+            run()
+            METRICS.reset()
+
+        started = time.perf_counter()
+        results = run()
+        wall = time.perf_counter() - started
+        transport.close()
+
+    latencies = [elapsed for elapsed, ok, cached in results if ok]
+    p50, p99 = percentile(latencies, 0.5), percentile(latencies, 0.99)
+    return {
+        **{key: value for key, value in scenario.items() if key != "url"},
+        "jobs": len(results),
+        "errors": sum(not ok for _, ok, _ in results),
+        "cached": sum(cached for _, _, cached in results),
+        "wall_s": round(wall, 3),
+        "jobs_per_s": round(len(results) / wall, 2) if wall else None,
+        "p50_ms": None if p50 is None else round(p50 * 1000, 1),
+        "p99_ms": None if p99 is None else round(p99 * 1000, 1),
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": METRICS.summary(),
+    }
+
+
+def build_scenarios(args, url):
+    scenarios = []
+    for path, grid, concurrency, hr, cache in itertools.product(
+            args.path, args.grid, args.concurrency, args.hr, args.cache):
+        if path == "request":
+            # The plain request path is sequential and uncached
+            concurrency, cache = 1, "off"
+        scenario = {"path": path, "grid": grid, "concurrency": concurrency, "hr": hr == "on",
+                    "cache": cache, "url": url}
+        if scenario not in scenarios:
+            scenarios.append(scenario)
+    return scenarios
+
+
+def run_isolated(function, argument):
+    with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(function, argument).result()
+
+
+def time_calls(name, function, repeat):
+    """Calls function(i) repeat times and returns a report row with per-call timings."""
+    timings = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        function(i)
+        timings.append(time.perf_counter() - started)
+    total = sum(timings)
+    return {
+        "name": name,
+        "calls": repeat,
+        "p50_us": round(percentile(timings, 0.5) * 1e6, 1),
+        "p99_us": round(percentile(timings, 0.99) * 1e6, 1),
+        "ops_per_s": round(repeat / total, 1) if total else None,
+    }
+
+
+def run_micro(repeat):
+    from qrgen import render_png
+    from utils import split_and_combine
+
+    render_png(CONTROL_DATA)
+    rows = [
+        time_calls("split_and_combine", lambda i: split_and_combine(MICRO_GRID), max(1, repeat // 20)),
+        # Distinct data per call so neither render_png nor module_matrix can answer from memory
+        time_calls("render_png (uncached)", lambda i: render_png.__wrapped__(f"{CONTROL_DATA}/{i}"), repeat),
+        time_calls("render_png (cached)", lambda i: render_png(CONTROL_DATA), repeat),
+    ]
+    try:
+        from decoder import decode_bytes
+    except ImportError as e:
+        rows.append({"name": "pyzbar decode", "skipped": str(e)})
+    else:
+        image = render_png(CONTROL_DATA)
+        rows.append(time_calls("pyzbar decode", lambda i: decode_bytes("benchmark.png", image), repeat))
+    return rows
+
+
+def scenario_key(row):
+    return (row["path"], row["grid"], row["concurrency"], row["hr"], row["cache"])
+
+
+def print_report(report, baseline=None, file=sys.stdout):
+    print(f"commit {report['commit']}  python {report['python']}  mock {report['mock']}", file=file)
+    before = {scenario_key(row): row for row in (baseline or {}).get("scenarios", [])}
+    if report["scenarios"]:
+        print(f"\n{'path':8} {'grid':>5} {'conc':>5} {'hr':>4} {'cache':>6} {'jobs/s':>8} {'p50 ms':>9} "
+              f"{'p99 ms':>9} {'errors':>7} {'rss MB':>8}", file=file)
+    for row in report["scenarios"]:
+        line = (f"{row['path']:8} {row['grid']:>5} {row['concurrency']:>5} {'on' if row['hr'] else 'off':>4} "
+                f"{row['cache']:>6} {row['jobs_per_s']:>8} {row['p50_ms']!s:>9} {row['p99_ms']!s:>9} "
+                f"{row['errors']:>7} {row['peak_rss_mb']:>8}")
+        old = before.get(scenario_key(row))
+        if old and old.get("jobs_per_s"):
+            line += f"  ({(row['jobs_per_s'] / old['jobs_per_s'] - 1) * 100:+.1f}% jobs/s)"
+        print(line, file=file)
+
+    before = {row["name"]: row for row in (baseline or {}).get("micro", [])}
+    if report["micro"]:
+        print(f"\n{'microbenchmark':24} {'calls':>6} {'p50 us':>10} {'p99 us':>10} {'ops/s':>10}", file=file)
+    for row in report["micro"]:
+        if "skipped" in row:
+            print(f"{row['name']:24} skipped: {row['skipped']}", file=file)
+            continue
+        line = f"{row['name']:24} {row['calls']:>6} {row['p50_us']:>10} {row['p99_us']:>10} {row['ops_per_s']:>10}"
+        old = before.get(row["name"])
+        if old and old.get("ops_per_s"):
+            line += f"  ({(row['ops_per_s'] / old['ops_per_s'] - 1) * 100:+.1f}% ops/s)"
+        print(line, file=file)
+
+
+def csv_list(kind):
+    return lambda value: [kind(item) for item in value.split(",") if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipeline against a mock webui")
+    parser.add_argument("--url", help="benchmark a running webui instead of starting the mock server")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock seconds per txt2img request")
+    parser.add_argument("--jitter", type=float, default=0.01, help="mock random +- seconds per request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="mock fraction of failed requests")
+    parser.add_argument("--image-size", type=parse_size, default=None, help="mock image size as WIDTHxHEIGHT")
+    parser.add_argument("--path", type=csv_list(str), default=["sweep", "request"], help="sweep,request")
+    parser.add_argument("--grid", type=csv_list(int), default=[8, 32], help="parameter combinations per sweep")
+    parser.add_argument("--concurrency", type=csv_list(int), default=[1, 4], help="requests in flight")
+    parser.add_argument("--hr", type=csv_list(str), default=["off", "on"], help="hires.fix: off,on")
+    parser.add_argument("--cache", type=csv_list(str), default=["cold", "warm"], help="result cache: off,cold,warm")
+    parser.add_argument("--micro-repeat", type=int, default=200, help="calls per microbenchmark")
+    parser.add_argument("--no-micro", action="store_true", help="skip the microbenchmarks")
+    parser.add_argument("--no-sweep", action="store_true", help="skip the sweep scenarios")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--compare", help="report saved with --json to compare against")
+    args = parser.parse_args(argv)
+
+    server = None
+    url = args.url
+    if not url and not args.no_sweep:
+        settings = MockSettings(args.latency, args.jitter, args.failure_rate, args.image_size, seed=0)
+        server = MockA1111(settings=settings).start()
+        url = server.url
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "mock": None if args.url else {"latency": args.latency, "jitter": args.jitter,
+                                       "failure_rate": args.failure_rate, "image_size": args.image_size},
+        "scenarios": [],
+        "micro": [],
+    }
+    try:
+        if not args.no_sweep:
+            for scenario in build_scenarios(args, url):
+                row = run_isolated(run_scenario, scenario)
+                print(f"{row['path']} grid={row['grid']} concurrency={row['concurrency']} hr={row['hr']} "
+                      f"cache={row['cache']}: {row['jobs_per_s']} jobs/s", file=sys.stderr)
+                report["scenarios"].append(row)
+        if not args.no_micro:
+            report["micro"] = run_micro(args.micro_repeat)
+    finally:
+        if server is not None:
+            server.stop()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
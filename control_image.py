@@ -0,0 +1,112 @@
+from functools import lru_cache
+
+import numpy as np
+import qrcode
+from qrcode.exceptions import DataOverflowError
+from qrcode.util import MODE_8BIT_BYTE, MODE_ALPHA_NUM, MODE_NUMBER, QRData
+
+from qrgen import ERROR_CORRECTION_LEVELS, encode_png
+
+"""
+    Control images for the ControlNet QR model.
+
+    The plain QR PNG (10px modules, version fitted to the data) has nothing to
+    do with the 512px txt2img size, so the webui had to crop and interpolate it
+    on every job, which blurs module edges. build_control_image renders the
+    code at exactly the generation size instead: every module is the same
+    whole number of pixels and the leftover pixels are split evenly into the
+    quiet zone. ControlnetRequest sends such an image as is, with resizing
+    disabled.
+"""
+
+# Matches width / height / processor_res of controlnet.BODY_TEMPLATE
+DEFAULT_SIZE = 512
+DEFAULT_QUIET_ZONE = 4
+
+# With error correction "auto" the strongest level is picked whose modules
+# are still at least this many pixels wide at the target size
+MIN_MODULE_PX = 8
+
+ENCODING_MODES = {
+    "Numeric": MODE_NUMBER,
+    "Alphanumeric": MODE_ALPHA_NUM,
+    "Byte": MODE_8BIT_BYTE,
+}
+_MODE_NAMES = {mode: name for name, mode in ENCODING_MODES.items()}
+
+
+class ControlImage:
+    def __init__(self, png, size, version, error_correction, modes, module_px, quiet_zone):
+        self.png = png
+        self.size = size
+        self.version = version
+        self.error_correction = error_correction
+        # Encoding modes of the data segments, more than one when the payload was split
+        self.modes = modes
+        self.module_px = module_px
+        # Quiet zone in modules, before the leftover pixels are added around it
+        self.quiet_zone = quiet_zone
+
+    def as_dict(self):
+        return {"size": self.size, "version": self.version, "error correction": self.error_correction,
+                "modes": ", ".join(self.modes), "module px": self.module_px, "quiet zone": self.quiet_zone}
+
+
+def make_code(data, error_correction="M", version=None, mode="auto"):
+    """
+    Encodes data and returns the qrcode.QRCode. version None picks the smallest
+    version that fits; mode "auto" lets qrcode split the data into the most compact
+    numeric / alphanumeric / byte segments.
+    """
+    qr = qrcode.QRCode(version=version, error_correction=ERROR_CORRECTION_LEVELS[error_correction],
+                       box_size=1, border=0)
+    if mode == "auto":
+        qr.add_data(data)
+    else:
+        try:
+            qr.add_data(QRData(data, mode=ENCODING_MODES[mode]))
+        except ValueError:
+            raise ValueError(f"The data can not be encoded in {mode} mode")
+    try:
+        qr.make(fit=version is None)
+    except DataOverflowError:
+        raise ValueError(f"The data does not fit in a version {version} QR code at error correction {error_correction}")
+    return qr
+
+
+def _module_px(modules, size, quiet_zone):
+    return size // (modules + 2 * quiet_zone)
+
+
+def choose_error_correction(data, size=DEFAULT_SIZE, quiet_zone=DEFAULT_QUIET_ZONE, version=None, mode="auto",
+                            min_module_px=MIN_MODULE_PX):
+    """The strongest error correction level that keeps modules at least min_module_px wide."""
+    for level in ("H", "Q", "M"):
+        try:
+            qr = make_code(data, level, version, mode)
+        except ValueError:
+            continue
+        if _module_px(qr.modules_count, size, quiet_zone) >= min_module_px:
+            return level
+    return "L"
+
+
+@lru_cache(maxsize=64)
+def build_control_image(data, size=DEFAULT_SIZE, error_correction="auto", version=None, mode="auto",
+                        quiet_zone=DEFAULT_QUIET_ZONE):
+    """Renders data as a size x size control image with pixel aligned modules."""
+    if error_correction == "auto":
+        error_correction = choose_error_correction(data, size, quiet_zone, version, mode)
+    qr = make_code(data, error_correction, version, mode)
+    matrix = np.array(qr.get_matrix(), dtype=bool)
+    module_px = _module_px(len(matrix), size, quiet_zone)
+    if module_px < 1:
+        raise ValueError(f"A version {qr.version} QR code does not fit in {size}px with a quiet zone of {quiet_zone}")
+
+    code_px = len(matrix) * module_px
+    offset = (size - code_px) // 2
+    pixels = np.zeros((size, size), dtype=bool)
+    pixels[offset:offset + code_px, offset:offset + code_px] = np.repeat(
+        np.repeat(matrix, module_px, axis=0), module_px, axis=1)
+    modes = [_MODE_NAMES.get(segment.mode, str(segment.mode)) for segment in qr.data_list]
+    return ControlImage(encode_png(pixels), size, qr.version, error_correction, modes, module_px, quiet_zone)
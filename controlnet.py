@@ -1,6 +1,16 @@
-import cv2
 import base64
-import requests
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+
+from metrics import observe_bytes, span
+from response_stream import CHUNK_SIZE, parse_txt2img
+from transport import get_transport
 
 """
     To use this example make sure you've done the following steps before executing:
@@ -9,59 +19,134 @@ import requests
             ./webui.sh --no-half --api
     2. Validate python environment meet package dependencies.
        If running in a local repo you'll likely need to pip install cv2, requests and PIL 
+    3. Point the requests at the webui with the A1111_URL environment variable
+       or by passing a Transport, when it is not running on 127.0.0.1:7860.
 """
 
+TXT2IMG_PATH = "/sdapi/v1/txt2img"
+
+# Base txt2img body shared by every request. build_body() copies it and only
+# fills in the per-job fields, so the dict literal is not rebuilt per job.
+BODY_TEMPLATE = {
+    "prompt": "",
+    "negative_prompt": "",
+    "batch_size": 1,
+    "cfg_scale": 7,
+    "width": 512,
+    "height": 512,
+    "sampler_name": "DPM++ 2M Karras",
+    "steps": 15, # Sampling steps
+    "enable_hr": False, # Hires.fix
+    "hr_scale": 2,
+    "hr_upscaler": "Latent",
+    "hr_second_pass_steps": 10, # Hires steps (0 for same steps as Sampler)
+    "denoising_strength": 1,
+    "sd_model_name": "icbinpICantBelieveIts_seco", # Replace with SD checkpoint
+    "sd_model_hash": "fa1224c923", # Replace with SD checkpoint
+    "seed": -1,
+    "seed_resize_from_w": -1,
+    "seed_resize_from_h": -1,
+    "restore_faces": False,
+    "alwayson_scripts": {
+        "controlnet": {
+            "args": [
+                {
+                    "enabled": True,
+                    "module": "invert (from white bg & black line)",
+                    "model": "control_v1p_sd15_qrcode_monster_v2 [5e5778cb]", # ControlNet QR Model
+                    "weight": 1.25, # Control Weight
+                    "image": None,
+                    "resize_mode": "Crop and Resize",
+                    "lowvram": False,
+                    "processor_res": 512,
+                    "guidance_start": 0.0, # Starting Control Step
+                    "guidance_end": 0.75, # Ending Control Step
+                    "control_mode": "Balanced",
+                    "pixel_perfect": False
+                }
+            ]
+        }
+    }
+}
+
+# Prepared control images, keyed by the sha256 of the file contents. A sweep
+# reuses one control image for every job, so it is read and encoded once.
+CONTROL_IMAGE_CACHE_SIZE = 8
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_control_images = OrderedDict()
+_control_digests = {}
+_control_lock = threading.Lock()
+
+
+def control_image_digest(path):
+    """Returns the content hash of the image at path, hashing each file version once."""
+    stat = os.stat(path)
+    stat_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _control_lock:
+        digest = _control_digests.get(stat_key)
+    if digest is None:
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        with _control_lock:
+            _control_digests[stat_key] = digest
+    return digest
+
+
+def _png_size(data):
+    """(width, height) from the IHDR chunk of PNG bytes, None if data is not a PNG."""
+    if data[:8] != PNG_SIGNATURE or data[12:16] != b"IHDR":
+        return None
+    return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+
+
+def load_control_image(path):
+    """Returns (base64 PNG payload, (width, height)) for the control image at path."""
+    digest = control_image_digest(path)
+    with _control_lock:
+        entry = _control_images.get(digest)
+        if entry is not None:
+            _control_images.move_to_end(digest)
+            return entry
+
+    with open(path, "rb") as f:
+        data = f.read()
+    size = _png_size(data)
+    if size is None:
+        # Not a PNG, let OpenCV convert it
+        img = cv2.imread(path)
+        retval, data = cv2.imencode('.png', img)
+        size = (img.shape[1], img.shape[0])
+    # PNGs are sent as they are, a 1 bit control image stays a few KB
+    entry = (base64.b64encode(data).decode('utf-8'), size)
+
+    with _control_lock:
+        _control_images[digest] = entry
+        while len(_control_images) > CONTROL_IMAGE_CACHE_SIZE:
+            _control_images.popitem(last=False)
+    return entry
+
+
 class ControlnetRequest:
-    def __init__(self, prompt, path):
-        self.url = "http://127.0.0.1:7860/sdapi/v1/txt2img"
+    def __init__(self, prompt, path, transport=None):
+        self.transport = transport or get_transport()
+        self.url = self.transport.url(TXT2IMG_PATH)
         self.prompt = prompt
         self.img_path = path
         self.body = None
 
     def build_body(self):
-        self.body = {
-            "prompt": self.prompt,
-            "negative_prompt": "",
-            "batch_size": 1,
-            "cfg_scale": 7,
-            "width": 512,
-            "height": 512,
-            "sampler_name": "DPM++ 2M Karras",
-            "steps": 15, # Sampling steps
-            "cfg_scale": 7,
-            "enable_hr": False, # Hires.fix
-            "hr_scale": 2,
-            "hr_upscaler": "Latent",
-            "hr_second_pass_steps": 10, # Hires steps (0 for same steps as Sampler)
-            "denoising_strength": 1,
-            "batch_size": 1,
-            "sd_model_name": "icbinpICantBelieveIts_seco", # Replace with SD checkpoint
-            "sd_model_hash": "fa1224c923", # Replace with SD checkpoint
-            "seed": -1,
-            "seed_resize_from_w": -1,
-            "seed_resize_from_h": -1,
-            "restore_faces": False,
-            "alwayson_scripts": {
-                "controlnet": {
-                    "args": [
-                        {
-                            "enabled": True,
-                            "module": "invert (from white bg & black line)",
-                            "model": "control_v1p_sd15_qrcode_monster_v2 [5e5778cb]", # ControlNet QR Model
-                            "weight": 1.25, # Control Weight
-                            "image": self.read_image(),
-                            "resize_mode": "Crop and Resize",
-                            "lowvram": False,
-                            "processor_res": 512,
-                            "guidance_start": 0.0, # Starting Control Step
-                            "guidance_end": 0.75, # Ending Control Step
-                            "control_mode": "Balanced",
-                            "pixel_perfect": False
-                        }
-                    ]
-                }
-            }
-        }
+        with span("control_image_prep"):
+            image, size = load_control_image(self.img_path)
+        observe_bytes("control_image", len(image))
+        with span("body_build"):
+            # deepcopy only duplicates the small nested dicts; the (large) encoded
+            # image string is shared between every request built from it.
+            self.body = copy.deepcopy(BODY_TEMPLATE)
+            self.body["prompt"] = self.prompt
+            self.update_cn({"image": image})
+            if size == (self.body["width"], self.body["height"]):
+                # Already at the generation size (see control_image.py), use it pixel for pixel
+                self.update_cn({"resize_mode": "Just Resize", "processor_res": size[0]})
     
     def update_sd(self, update_dict):
         self.body.update(update_dict)
@@ -70,12 +155,60 @@ class ControlnetRequest:
         self.body["alwayson_scripts"]["controlnet"]["args"][0].update(update_dict)
 
     def send_request(self):
-        print(self.body)
-        response = requests.post(url=self.url, json=self.body)
-        return response.json()
+        with span("http_wait"):
+            response = self.transport.post(TXT2IMG_PATH, json=self.body)
+        with span("response_decode"):
+            output = response.json()
+        observe_bytes("response", len(response.content))
+        return output
+
+    def send_request_stream(self, sink_for_image):
+        """
+        Sends the request and streams the response through response_stream.parse_txt2img,
+        so images are base64-decoded straight into their sinks without building the full JSON.
+        """
+        # The webui only answers once the image is rendered, so http_wait covers
+        # generation; response_decode covers downloading, decoding and writing the body
+        with span("http_wait"):
+            response = self.transport.post(TXT2IMG_PATH, json=self.body, stream=True)
+        received = [0]
+
+        def chunks():
+            for chunk in response.iter_content(CHUNK_SIZE):
+                received[0] += len(chunk)
+                yield chunk
+
+        with response, span("response_decode"):
+            output = parse_txt2img(chunks(), sink_for_image)
+        observe_bytes("response", received[0])
+        return output
 
     def read_image(self):
-        img = cv2.imread(self.img_path)
-        retval, bytes = cv2.imencode('.png', img)
-        encoded_image = base64.b64encode(bytes).decode('utf-8')
-        return encoded_image
\ No newline at end of file
+        return load_control_image(self.img_path)[0]
+
+    def cache_key(self):
+        """Hashes every field that affects the rendered image, with the control image by content hash."""
+        body = dict(self.body)
+        body["alwayson_scripts"] = copy.deepcopy(self.body["alwayson_scripts"])
+        body["alwayson_scripts"]["controlnet"]["args"][0]["image"] = control_image_digest(self.img_path)
+        return hashlib.sha256(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def response_seed(output):
+    """Returns the seed the webui actually used for a txt2img response, if it reported one."""
+    try:
+        return json.loads(output.get("info") or "{}").get("seed")
+    except (ValueError, AttributeError):
+        return None
+
+
+def response_seeds(output):
+    """Returns the seed of every image of a (batched) txt2img response, in image order."""
+    try:
+        info = json.loads(output.get("info") or "{}")
+    except (ValueError, AttributeError):
+        return []
+    seeds = info.get("all_seeds")
+    if seeds:
+        return seeds
+    return [info["seed"]] if info.get("seed") is not None else []
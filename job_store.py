@@ -0,0 +1,379 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from backend_pool import get_backend_pool
+from metrics import METRICS
+from result_cache import get_result_cache
+from sweep import JobCancelled, SweepExecutor, SweepJob
+
+"""
+    Durable job queue for AI QR sweeps.
+
+    Every prompt x parameter job of a sweep is written to SQLite before any of
+    it runs. A JobWorker thread drains pending jobs independently of the
+    Streamlit script, so reruns, refreshes and closed tabs do not stop a sweep;
+    the page only polls the store. Jobs that were running when the process died
+    are put back to pending on startup, finished jobs are never rendered again.
+    Cancelling a sweep marks its pending jobs cancelled and interrupts the jobs
+    already running on the webui.
+
+    Scannability searches (sweeps with settings["adaptive"], see
+    optimizer.AdaptiveSweep) are queued the same way: the store holds the next
+    job of every prompt, the worker adds the following one as each job finishes
+    and rebuilds the searches from the finished jobs when a sweep is resumed.
+"""
+
+# Attempts at a sweep that keeps raising before its remaining jobs are marked failed
+MAX_SWEEP_ERRORS = 3
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.environ.get("QR_JOB_DB", os.path.join(os.getcwd(), ".cache", "jobs.sqlite3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sweeps (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    out_dir TEXT NOT NULL,
+    control_path TEXT NOT NULL,
+    payload TEXT,
+    settings TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    sweep_id INTEGER NOT NULL REFERENCES sweeps(id),
+    prompt_index INTEGER NOT NULL,
+    param_index INTEGER NOT NULL,
+    prompt TEXT NOT NULL,
+    params TEXT NOT NULL,
+    enable_hr INTEGER NOT NULL,
+    seed INTEGER NOT NULL,
+    repeat INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    used_seed INTEGER,
+    output_path TEXT,
+    error TEXT,
+    cached INTEGER,
+    scannable INTEGER,
+    started_at REAL,
+    finished_at REAL,
+    elapsed REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_sweep_status ON jobs (sweep_id, status);
+"""
+
+
+def claim_size(settings):
+    """
+    Jobs a JobWorker claims at a time: enough to keep every request slot busy with full
+    txt2img batches, rounded up to whole combinations, since a claim boundary inside
+    one would split its repeats over two requests.
+    """
+    batch = max(1, settings.get("concurrency", 2)) * settings.get("max_batch", 1) * settings.get("max_iter", 1)
+    repeats = settings.get("repeats", 1)
+    return -(-batch // repeats) * repeats
+
+
+class JobStore:
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def _execute(self, sql, args=()):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def create_sweep(self, jobs, out_dir, control_path, settings, payload=None):
+        """Stores a sweep and all of its SweepJobs, returns the sweep id."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                cursor = self._conn.execute(
+                    "INSERT INTO sweeps (created_at, out_dir, control_path, payload, settings) VALUES (?, ?, ?, ?, ?)",
+                    (time.time(), out_dir, control_path, payload, json.dumps(settings)))
+                sweep_id = cursor.lastrowid
+                self._insert_jobs(sweep_id, jobs)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return sweep_id
+
+    def _insert_jobs(self, sweep_id, jobs):
+        self._conn.executemany(
+            "INSERT INTO jobs (sweep_id, prompt_index, param_index, prompt, params, enable_hr, seed, repeat)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            ((sweep_id, job.prompt_index, job.param_index, job.prompt, json.dumps(job.params),
+              int(job.enable_hr), job.seed, job.repeat) for job in jobs))
+
+    def sweep(self, sweep_id):
+        rows = self._execute("SELECT * FROM sweeps WHERE id = ?", (sweep_id,))
+        if not rows:
+            return None
+        sweep = dict(rows[0])
+        sweep["settings"] = json.loads(sweep["settings"])
+        return sweep
+
+    def sweeps(self, limit=20):
+        """Most recent sweeps first, with their job counts by status."""
+        sweeps = [dict(row) for row in self._execute("SELECT * FROM sweeps ORDER BY id DESC LIMIT ?", (limit,))]
+        for sweep in sweeps:
+            sweep["settings"] = json.loads(sweep["settings"])
+            sweep["counts"] = self.counts(sweep["id"])
+        return sweeps
+
+    def counts(self, sweep_id):
+        """Number of jobs of a sweep per status, plus a 'total'."""
+        counts = {"pending": 0, "running": 0, "done": 0, "failed": 0, "cancelled": 0}
+        for row in self._execute("SELECT status, COUNT(*) AS n FROM jobs WHERE sweep_id = ? GROUP BY status", (sweep_id,)):
+            counts[row["status"]] = row["n"]
+        counts["total"] = sum(counts.values())
+        return counts
+
+    def next_sweep(self):
+        """Oldest sweep that still has pending jobs, or None."""
+        rows = self._execute("SELECT MIN(sweep_id) AS id FROM jobs WHERE status = 'pending'")
+        return rows[0]["id"] if rows else None
+
+    def claim(self, sweep_id, limit):
+        """Marks up to limit pending jobs of a sweep as running and returns them as SweepJobs."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT * FROM jobs WHERE sweep_id = ? AND status = 'pending' ORDER BY id LIMIT ?",
+                    (sweep_id, limit)).fetchall()
+                self._conn.executemany("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+                                       ((time.time(), row["id"]) for row in rows))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [self._job(row) for row in rows]
+
+    def _job(self, row):
+        job = SweepJob(row["prompt_index"], row["param_index"], row["prompt"], json.loads(row["params"]),
+                       bool(row["enable_hr"]), None, row["seed"], row["repeat"])
+        job.job_id = row["id"]
+        return job
+
+    def finish(self, result, next_job=None):
+        """
+        Records a SweepResult for the job it ran. In the same transaction queues next_job, the
+        following job of the same sweep and prompt, unless that prompt still has unfinished jobs.
+        """
+        if result.ok:
+            status = "done"
+        else:
+            status = "cancelled" if isinstance(result.error, JobCancelled) else "failed"
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, used_seed = ?, output_path = ?, error = ?, cached = ?, scannable = ?,"
+                    " finished_at = ?, elapsed = ? WHERE id = ?",
+                    (status, result.seed, result.path,
+                     None if result.ok else str(result.error), int(result.cached),
+                     None if result.scannable is None else int(result.scannable),
+                     time.time(), result.elapsed, result.job.job_id))
+                if next_job is not None:
+                    sweep_id = self._conn.execute("SELECT sweep_id FROM jobs WHERE id = ?",
+                                                  (result.job.job_id,)).fetchone()["sweep_id"]
+                    unfinished = self._conn.execute(
+                        "SELECT COUNT(*) AS n FROM jobs WHERE sweep_id = ? AND prompt_index = ?"
+                        " AND status IN ('pending', 'running')", (sweep_id, next_job.prompt_index)).fetchone()["n"]
+                    if not unfinished:
+                        self._insert_jobs(sweep_id, [next_job])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def finished(self, sweep_id):
+        """(prompt index, params, scannable or None if it failed) of the done and failed jobs, oldest first."""
+        rows = self._execute("SELECT prompt_index, params, status, scannable FROM jobs WHERE sweep_id = ?"
+                             " AND status IN ('done', 'failed') ORDER BY finished_at, id", (sweep_id,))
+        return [(row["prompt_index"], json.loads(row["params"]),
+                 bool(row["scannable"]) if row["status"] == "done" else None) for row in rows]
+
+    def recover(self):
+        """Puts jobs left running by a previous process back in the queue."""
+        self._execute("UPDATE jobs SET status = 'pending', started_at = NULL WHERE status = 'running'")
+
+    def requeue(self, sweep_id):
+        """Puts the claimed but unfinished jobs of a sweep back in the queue."""
+        self._execute("UPDATE jobs SET status = 'pending', started_at = NULL WHERE sweep_id = ? AND status = 'running'",
+                      (sweep_id,))
+
+    def fail(self, sweep_id, error):
+        """Marks every unfinished job of a sweep failed with error, they can be retried from the monitor."""
+        self._execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE sweep_id = ?"
+            " AND status IN ('pending', 'running')",
+            (error, time.time(), sweep_id))
+
+    def cancel(self, sweep_id, running=False):
+        """Cancels the pending jobs of a sweep, and with running=True also the ones claimed but unfinished."""
+        statuses = ("pending", "running") if running else ("pending",)
+        self._execute(
+            f"UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE sweep_id = ?"
+            f" AND status IN ({', '.join('?' * len(statuses))})",
+            (time.time(), sweep_id, *statuses))
+
+    def mean_elapsed(self, sweep_id):
+        """Average seconds per rendered (not cached) job of a sweep, None before the first one."""
+        rows = self._execute("SELECT AVG(elapsed) AS mean FROM jobs WHERE sweep_id = ? AND status = 'done'"
+                             " AND NOT cached", (sweep_id,))
+        return rows[0]["mean"]
+
+    def retry_failed(self, sweep_id):
+        self._execute("UPDATE jobs SET status = 'pending', error = NULL WHERE sweep_id = ? AND status = 'failed'",
+                      (sweep_id,))
+
+    def results(self, sweep_id, limit=None, offset=0, status=None):
+        """Finished jobs of a sweep (only those with status if given), most recently finished first."""
+        statuses = (status,) if status else ("done", "failed")
+        sql = (f"SELECT * FROM jobs WHERE sweep_id = ? AND status IN ({', '.join('?' * len(statuses))})"
+               " ORDER BY finished_at DESC LIMIT ? OFFSET ?")
+        rows = self._execute(sql, (sweep_id, *statuses, -1 if limit is None else limit, offset))
+        return [dict(row, params=json.loads(row["params"])) for row in rows]
+
+
+class JobWorker(threading.Thread):
+    """Background thread that drains pending jobs from a JobStore, one sweep at a time."""
+
+    def __init__(self, store, scan_factory=None, poll_interval=2.0):
+        super().__init__(name="job-worker", daemon=True)
+        self.store = store
+        # Optional callable(payload) returning a SweepExecutor scan callback
+        self.scan_factory = scan_factory
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        # Sweep being run, with its executor and its view of the backend pool, for cancel()
+        self.current_sweep = None
+        self._executor = None
+        self._client = None
+        self._cancel = threading.Event()
+        # Consecutive failed attempts per sweep
+        self._errors = {}
+        # Set when a job finishes or the run stops, wakes a feeder waiting for a search's next job
+        self._progress = threading.Event()
+        self._stopped = False
+
+    def notify(self):
+        """Wakes the worker up after new jobs were stored."""
+        self._wake.set()
+
+    def cancel(self, sweep_id):
+        """Drops the pending jobs of a sweep and interrupts its running ones."""
+        self.store.cancel(sweep_id)
+        if self.current_sweep == sweep_id:
+            self._cancel.set()
+            executor, client = self._executor, self._client
+            if executor is not None:
+                executor.cancel()
+            if client is not None:
+                client.interrupt()
+
+    def run(self):
+        self.store.recover()
+        while True:
+            sweep_id = self.store.next_sweep()
+            if sweep_id is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            try:
+                self.run_sweep(sweep_id)
+            except Exception as e:
+                # Keep the worker alive, the jobs stay in the store for another attempt
+                errors = self._errors.get(sweep_id, 0) + 1
+                logger.exception("Sweep %s failed (attempt %d of %d)", sweep_id, errors, MAX_SWEEP_ERRORS)
+                if errors < MAX_SWEEP_ERRORS:
+                    self._errors[sweep_id] = errors
+                    time.sleep(self.poll_interval)
+                else:
+                    # Give up so the next sweep can run, the failed jobs can be retried from the monitor
+                    self._errors.pop(sweep_id, None)
+                    self.store.fail(sweep_id, f"Sweep stopped after {errors} failed attempts: {e}")
+            else:
+                self._errors.pop(sweep_id, None)
+
+    def run_sweep(self, sweep_id):
+        sweep = self.store.sweep(sweep_id)
+        settings = sweep["settings"]
+        scan = None
+        if self.scan_factory and sweep["payload"]:
+            scan = self.scan_factory(sweep["payload"])
+        # Interrupts must not reach requests of other executors sharing the pool
+        client = get_backend_pool(settings.get("backends")).client()
+        executor = SweepExecutor(
+            http_workers=settings.get("concurrency", 2),
+            io_workers=settings.get("concurrency", 2),
+            transport=client,
+            cache=get_result_cache() if settings.get("use_cache") else None,
+            scan=scan,
+            max_batch=settings.get("max_batch", 1),
+            max_iter=settings.get("max_iter", 1),
+        )
+        adaptive = None
+        if settings.get("adaptive"):
+            from optimizer import AdaptiveSweep
+            adaptive = AdaptiveSweep.from_settings(settings["adaptive"], sweep["control_path"],
+                                                   self.store.finished(sweep_id))
+        self._cancel.clear()
+        self._stopped = False
+        self.current_sweep, self._executor, self._client = sweep_id, executor, client
+        results = executor.run(self._pending_jobs(sweep, wait=adaptive is not None), sweep["out_dir"])
+        try:
+            for result in results:
+                next_job = adaptive.advance(result) if adaptive is not None else None
+                self.store.finish(result, None if self._cancel.is_set() else next_job)
+                self._progress.set()
+                # Keep the Prometheus file current while a long sweep runs
+                METRICS.flush()
+                if self._cancel.is_set():
+                    # Requests queued on a node start once the interrupted one returns, stop them too
+                    client.interrupt()
+        finally:
+            # Stops the feeder first, so nothing is claimed after the cleanup below
+            self._stopped = True
+            self._progress.set()
+            results.close()
+            # Jobs claimed but never finished, because they were cancelled before reaching
+            # the executor or because the run broke off with an error
+            if self._cancel.is_set():
+                self.store.cancel(sweep_id, running=True)
+            else:
+                self.store.requeue(sweep_id)
+            self.current_sweep = self._executor = self._client = None
+
+    def _pending_jobs(self, sweep, wait=False):
+        # Claim in small batches so jobs stay pending (and resumable) until they run,
+        # but enough of them for the executor to fill a txt2img batch. With wait, keep
+        # going while jobs run: each one may queue the next job of its search.
+        batch = claim_size(sweep["settings"])
+        while not self._cancel.is_set() and not self._stopped:
+            self._progress.clear()
+            jobs = self.store.claim(sweep["id"], batch)
+            if not jobs:
+                if not wait or not self.store.counts(sweep["id"])["running"]:
+                    return
+                self._progress.wait(self.poll_interval)
+                continue
+            for job in jobs:
+                if self._cancel.is_set():
+                    return
+                job.control_path = sweep["control_path"]
+                yield job
@@ -0,0 +1,207 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from urllib.parse import quote, urlsplit
+
+"""
+    Load test for the QR API (qr_server.py).
+
+    Starts a server in its own process, unless --url points at a running one,
+    and drives it for --duration seconds over --connections keep-alive
+    connections spread across --processes client processes, so the client is
+    not what runs out of CPU first.
+
+    Requests cycle through --unique distinct payloads: a small number measures
+    the LRU hit path, a large one the render path. --conditional is the
+    fraction of requests that revalidate an ETag seen earlier with
+    If-None-Match, --decode the fraction that post a QR PNG to /v1/decode.
+
+    Reports requests/s, p50 / p99 / max latency, the status code mix and the
+    cache counters of the server.
+
+    Usage:
+        python load_test.py --duration 10 --connections 16 --unique 100
+        python load_test.py --unique 1000000 --format svg --workers 8
+        python load_test.py --url http://10.0.0.5:8080 --conditional 0.5
+"""
+
+# Distinct images used for /v1/decode requests
+DECODE_IMAGES = 16
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def generate_path(index, fmt):
+    return f"/v1/generate?type=URL&url={quote(f'https://example.com/item/{index}', safe='')}&format={fmt}"
+
+
+def _connection_loop(url, deadline, options, images, seed, results):
+    """Sends requests over one keep-alive connection until deadline and appends (seconds, status)."""
+    parts = urlsplit(url)
+    rng = random.Random(seed)
+    etags = {}
+    connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    while time.perf_counter() < deadline:
+        headers = {}
+        if images and rng.random() < options["decode"]:
+            method, path, body = "POST", "/v1/decode", rng.choice(images)
+            headers["Content-Type"] = "image/png"
+        else:
+            method, path, body = "GET", generate_path(rng.randrange(options["unique"]), options["format"]), None
+            if path in etags and rng.random() < options["conditional"]:
+                headers["If-None-Match"] = etags[path]
+        started = time.perf_counter()
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            status = "error"
+            connection.close()
+            connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        else:
+            if method == "GET" and response.getheader("ETag"):
+                etags[path] = response.getheader("ETag")
+        results.append((time.perf_counter() - started, status))
+    connection.close()
+
+
+def run_client(job):
+    """Runs one client process with a thread per connection. Returns [(seconds, status)]."""
+    url, connections, duration, options, images, seed = job
+    results = []
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=_connection_loop,
+                                args=(url, deadline, options, images, seed * 1000 + i, results))
+               for i in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def decode_images():
+    from qrgen import render_png
+
+    return [render_png(f"https://example.com/scan/{i}", box_size=4) for i in range(DECODE_IMAGES)]
+
+
+def fetch_json(url, path):
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+    try:
+        connection.request("GET", path)
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+def start_server(workers, cache_mb):
+    """Starts qr_server.py in a subprocess and returns (process, url) once it answers."""
+    port = free_port()
+    command = [sys.executable, "qr_server.py", "--port", str(port), "--cache-mb", str(cache_mb)]
+    if workers is not None:
+        command += ["--workers", str(workers)]
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"qr_server.py exited with {process.returncode}")
+        try:
+            fetch_json(url, "/healthz")
+            return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("qr_server.py did not start within 60s")
+
+
+def run(url, connections, processes, duration, options, warmup):
+    """Drives the server at url and returns the report."""
+    images = decode_images() if options["decode"] else []
+    processes = max(1, min(processes, connections))
+    jobs = [(url, connections // processes + (i < connections % processes), duration, options, images, i)
+            for i in range(processes)]
+    with ProcessPoolExecutor(processes, mp_context=get_context("spawn")) as pool:
+        if warmup:
+            list(pool.map(run_client, [(url, 1, warmup, options, images, -1 - i) for i in range(processes)]))
+        started = time.perf_counter()
+        results = [row for rows in pool.map(run_client, jobs) for row in rows]
+        elapsed = time.perf_counter() - started
+
+    latencies = [seconds for seconds, _ in results]
+    return {
+        "requests": len(results),
+        "seconds": round(elapsed, 2),
+        "requests/s": round(len(results) / elapsed, 1),
+        "p50 ms": round(percentile(latencies, 0.5) * 1000, 2) if results else None,
+        "p99 ms": round(percentile(latencies, 0.99) * 1000, 2) if results else None,
+        "max ms": round(max(latencies) * 1000, 2) if results else None,
+        "status": {str(status): count for status, count in sorted(Counter(s for _, s in results).items(), key=str)},
+        "server": fetch_json(url, "/healthz"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test for the QR API server")
+    parser.add_argument("--url", default=None, help="server to test, defaults to starting qr_server.py locally")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to measure")
+    parser.add_argument("--warmup", type=float, default=1.0, help="seconds of load before measuring")
+    parser.add_argument("--connections", type=int, default=16, help="concurrent keep-alive connections")
+    parser.add_argument("--processes", type=int, default=4, help="client processes the connections are spread over")
+    parser.add_argument("--unique", type=int, default=100, help="number of distinct payloads requested")
+    parser.add_argument("--format", default="png", choices=["png", "svg"])
+    parser.add_argument("--conditional", type=float, default=0.0,
+                        help="fraction of requests sent with If-None-Match for a known ETag")
+    parser.add_argument("--decode", type=float, default=0.0, help="fraction of requests posted to /v1/decode")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes of the local server")
+    parser.add_argument("--cache-mb", type=float, default=64, help="response cache size of the local server")
+    parser.add_argument("--json", default=None, help="write the report to this file")
+    args = parser.parse_args(argv)
+
+    options = {"unique": args.unique, "format": args.format, "conditional": args.conditional, "decode": args.decode}
+    process = None
+    url = args.url
+    if url is None:
+        process, url = start_server(args.workers, args.cache_mb)
+    try:
+        report = run(url, args.connections, args.processes, args.duration, options, args.warmup)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report["options"] = {**options, "connections": args.connections, "processes": args.processes}
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if report["requests"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+    Lightweight instrumentation for the generation pipeline.
+
+    span("http_wait") times a stage, observe_bytes("response", n) records a
+    payload size and errors are counted per stage. Everything is kept in
+    memory in the process wide METRICS registry, which can:
+    - append one JSON line per event to QR_METRICS_LOG (if set)
+    - render Prometheus text, written to QR_METRICS_PROM (if set) by flush()
+      or served on /metrics by start_http_server()
+    - summarize itself for the in-app metrics panel
+"""
+
+# Histogram buckets for stage durations, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Recent samples kept per stage for percentiles in the summary
+RESERVOIR_SIZE = 1024
+
+
+class _Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.recent = deque(maxlen=RESERVOIR_SIZE)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+    def percentile(self, q):
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Metrics:
+    def __init__(self, log_path=None, prom_path=None):
+        self.log_path = log_path
+        self.prom_path = prom_path
+        self._lock = threading.Lock()
+        self._log = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.sizes = {}
+            self.errors = {}
+
+    def _emit(self, event):
+        if not self.log_path:
+            return
+        event["ts"] = time.time()
+        line = json.dumps(event) + "\n"
+        with self._lock:
+            if self._log is None:
+                self._log = open(self.log_path, "a", buffering=1)
+            self._log.write(line)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.stages.setdefault(stage, _Histogram()).add(seconds)
+        self._emit({"stage": stage, "seconds": round(seconds, 6)})
+
+    def observe_bytes(self, kind, size):
+        with self._lock:
+            count, total = self.sizes.get(kind, (0, 0))
+            self.sizes[kind] = (count + 1, total + size)
+        self._emit({"bytes": kind, "size": size})
+
+    def error(self, stage):
+        with self._lock:
+            self.errors[stage] = self.errors.get(stage, 0) + 1
+        self._emit({"error": stage})
+
+    @contextmanager
+    def span(self, stage):
+        """Times the block as stage and counts it as an error of that stage if it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.error(stage)
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def summary(self):
+        """One row per stage for the metrics panel, in milliseconds."""
+        with self._lock:
+            rows = []
+            for stage, hist in sorted(self.stages.items()):
+                rows.append({
+                    "stage": stage,
+                    "count": hist.count,
+                    "errors": self.errors.get(stage, 0),
+                    "mean ms": round(hist.total / hist.count * 1000, 2),
+                    "p50 ms": round(hist.percentile(0.5) * 1000, 2),
+                    "p99 ms": round(hist.percentile(0.99) * 1000, 2),
+                    "max ms": round(hist.max * 1000, 2),
+                    "total s": round(hist.total, 2),
+                })
+            return rows
+
+    def size_summary(self):
+        with self._lock:
+            return [{"payload": kind, "count": count, "mean KB": round(total / count / 1024, 1),
+                     "total MB": round(total / 1024 ** 2, 2)}
+                    for kind, (count, total) in sorted(self.sizes.items())]
+
+    def prometheus_text(self):
+        with self._lock:
+            lines = ["# HELP qr_stage_seconds Time spent per pipeline stage",
+                     "# TYPE qr_stage_seconds histogram"]
+            for stage, hist in sorted(self.stages.items()):
+                for bound, count in zip(BUCKETS, hist.buckets):
+                    lines.append(f'qr_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'qr_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist.count}')
+                lines.append(f'qr_stage_seconds_sum{{stage="{stage}"}} {hist.total}')
+                lines.append(f'qr_stage_seconds_count{{stage="{stage}"}} {hist.count}')
+            lines += ["# HELP qr_payload_bytes Payload sizes by kind", "# TYPE qr_payload_bytes summary"]
+            for kind, (count, total) in sorted(self.sizes.items()):
+                lines.append(f'qr_payload_bytes_sum{{kind="{kind}"}} {total}')
+                lines.append(f'qr_payload_bytes_count{{kind="{kind}"}} {count}')
+            lines += ["# HELP qr_errors_total Failures by pipeline stage", "# TYPE qr_errors_total counter"]
+            for stage, count in sorted(self.errors.items()):
+                lines.append(f'qr_errors_total{{stage="{stage}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """Writes the Prometheus text file, if one is configured."""
+        if not self.prom_path:
+            return
+        tmp = f"{self.prom_path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, self.prom_path)
+
+
+METRICS = Metrics(os.environ.get("QR_METRICS_LOG"), os.environ.get("QR_METRICS_PROM"))
+
+span = METRICS.span
+observe_bytes = METRICS.observe_bytes
+
+
+def start_http_server(port, registry=METRICS, host="0.0.0.0"):
+    """Serves registry as Prometheus text on http://host:port/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,220 @@
+import argparse
+import base64
+import io
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from PIL import Image
+
+"""
+    Local stand-in for the automatic1111 webui API, for benchmarks without a GPU.
+
+    POST /sdapi/v1/txt2img sleeps for a configurable latency (plus jitter, and
+    scaled up for hires.fix jobs), fails a configurable fraction of requests
+    with a 500 and otherwise answers like the webui does: a noise PNG of the
+    requested size (so it does not compress away), the request echoed under
+    "parameters" and an "info" string with the seed. /sdapi/v1/options and
+    /controlnet/model_list answer health checks, /sdapi/v1/progress reports
+    the oldest running request and /sdapi/v1/interrupt ends running requests
+    early.
+
+    Usage:
+        python mock_a1111.py --port 7861 --latency 2 --jitter 0.5 --failure-rate 0.05
+"""
+
+CHECKPOINT = "icbinpICantBelieveIts_seco [fa1224c923]"
+CONTROLNET_MODELS = ["control_v1p_sd15_qrcode_monster_v2 [5e5778cb]"]
+
+# Latency of every extra image in a batch, relative to the first one
+BATCH_IMAGE_COST = 0.6
+
+
+class MockSettings:
+    def __init__(self, latency=1.0, jitter=0.0, failure_rate=0.0, image_size=None, hr_factor=2.0, seed=None):
+        # Seconds per txt2img request, +- up to jitter seconds
+        self.latency = latency
+        self.jitter = jitter
+        # Fraction of txt2img requests answered with a 500
+        self.failure_rate = failure_rate
+        # (width, height) of returned images, None follows the request
+        self.image_size = image_size
+        # Latency multiplier for hires.fix requests
+        self.hr_factor = hr_factor
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        # (started, delay, interrupt event) per running txt2img request
+        self.running = []
+
+    def delay(self, body):
+        with self.lock:
+            delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if body.get("enable_hr"):
+            delay *= self.hr_factor
+        # A batch costs less than its images one by one, iterations run back to back
+        batch_size = body.get("batch_size", 1)
+        delay *= (1 + BATCH_IMAGE_COST * (batch_size - 1)) * body.get("n_iter", 1)
+        return max(0.0, delay)
+
+    def should_fail(self):
+        with self.lock:
+            self.requests += 1
+            failed = self.random.random() < self.failure_rate
+            self.failures += failed
+            return failed
+
+
+_images = {}
+_images_lock = threading.Lock()
+
+
+def noise_png(width, height):
+    """Base64 PNG of random pixels, generated once per size."""
+    with _images_lock:
+        encoded = _images.get((width, height))
+        if encoded is None:
+            pixels = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+            buffer = io.BytesIO()
+            Image.fromarray(pixels).save(buffer, format="PNG", compress_level=1)
+            encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+            _images[(width, height)] = encoded
+        return encoded
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def settings(self):
+        return self.server.settings
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _progress(self):
+        with self.settings.lock:
+            running = list(self.settings.running)
+        if not running:
+            return {"progress": 0.0, "eta_relative": 0.0, "state": {"job_count": 0}, "current_image": None}
+        started, delay, _ = running[0]
+        progress = min(1.0, (time.monotonic() - started) / delay) if delay else 1.0
+        return {"progress": progress, "eta_relative": max(0.0, delay - (time.monotonic() - started)),
+                "state": {"job_count": len(running), "sampling_step": int(progress * 20), "sampling_steps": 20},
+                "current_image": noise_png(64, 64)}
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/sdapi/v1/progress":
+            self._send_json(200, self._progress())
+        elif self.path == "/sdapi/v1/options":
+            self._send_json(200, {"sd_model_checkpoint": CHECKPOINT})
+        elif self.path == "/controlnet/model_list":
+            self._send_json(200, {"model_list": CONTROLNET_MODELS})
+        else:
+            self._send_json(404, {"detail": "Not Found"})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path == "/sdapi/v1/interrupt":
+            with self.settings.lock:
+                for _, _, interrupted in self.settings.running:
+                    interrupted.set()
+            self._send_json(200, {})
+            return
+        if self.path != "/sdapi/v1/txt2img":
+            self._send_json(404, {"detail": "Not Found"})
+            return
+        entry = (time.monotonic(), self.settings.delay(body), threading.Event())
+        with self.settings.lock:
+            self.settings.running.append(entry)
+        try:
+            entry[2].wait(entry[1])
+        finally:
+            with self.settings.lock:
+                self.settings.running.remove(entry)
+        if self.settings.should_fail():
+            self._send_json(500, {"error": "RuntimeError", "detail": "mock failure"})
+            return
+
+        width, height = self.settings.image_size or (body.get("width", 512), body.get("height", 512))
+        if body.get("enable_hr"):
+            scale = body.get("hr_scale", 2)
+            width, height = int(width * scale), int(height * scale)
+        seed = body.get("seed", -1)
+        if seed == -1:
+            seed = random.randrange(2 ** 31)
+        count = body.get("batch_size", 1) * body.get("n_iter", 1)
+        self._send_json(200, {
+            "images": [noise_png(width, height)] * count,
+            "parameters": body,
+            "info": json.dumps({"seed": seed, "all_seeds": [seed + index for index in range(count)],
+                                "prompt": body.get("prompt", ""), "width": width, "height": height}),
+        })
+
+    def log_message(self, *args):
+        pass
+
+
+class MockA1111(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, settings=None):
+        super().__init__((host, port), Handler)
+        self.settings = settings or MockSettings()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serves from a daemon thread and returns self."""
+        threading.Thread(target=self.serve_forever, name="mock-a1111", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def parse_size(value):
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height or width)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mock automatic1111 API server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7861)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds per txt2img request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +- seconds added to the latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--image-size", type=parse_size, default=None,
+                        help="returned image size as WIDTHxHEIGHT, defaults to the requested size")
+    parser.add_argument("--hr-factor", type=float, default=2.0, help="latency multiplier for hires.fix requests")
+    args = parser.parse_args(argv)
+
+    settings = MockSettings(args.latency, args.jitter, args.failure_rate, args.image_size, args.hr_factor)
+    server = MockA1111(args.host, args.port, settings)
+    print(f"Mock automatic1111 listening on {server.url}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
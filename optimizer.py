@@ -0,0 +1,185 @@
+import queue
+import threading
+
+from PIL import Image
+from pyzbar.pyzbar import decode
+
+from scoring import load_control_layout, score_image
+from sweep import SweepJob, derive_seed
+
+"""
+    Scannability driven search for AI QR codes.
+
+    Instead of rendering every grid combination, each prompt gets its own
+    WeightBisection. Lower control weights give more artistic images but stop
+    scanning at some point, so the search bisects towards the lowest weight
+    that still decodes to the original payload and stops once the prompt has
+    produced enough scannable results.
+"""
+
+
+def decode_payloads(path):
+    """Returns every QR payload pyzbar can read from the image at path."""
+    with Image.open(path) as image:
+        return [obj.data.decode('utf-8', 'replace') for obj in decode(image.convert("L"))]
+
+
+def is_scannable(path, payload, prefilter=True, control_path=None):
+    """
+    Checks whether the image at path decodes to payload.
+
+    With prefilter set, images whose module score is clearly too low are
+    rejected without running the (much slower) pyzbar decoder. The score uses
+    the module grid of the control image at control_path when it can be read.
+    """
+    with Image.open(path) as image:
+        gray = image.convert("L")
+    layout = load_control_layout(control_path) if control_path else None
+    if prefilter and not score_image(gray, payload, layout=layout).passes():
+        return False
+    return payload in [obj.data.decode('utf-8', 'replace') for obj in decode(gray)]
+
+
+class WeightBisection:
+    """Picks the next control weight for one prompt from the scan results so far."""
+
+    def __init__(self, prompt_index, prompt, params, low=0.5, high=2.0, target=3, max_jobs=12,
+                 tolerance=0.05, guidance_step=0.05):
+        self.prompt_index = prompt_index
+        self.prompt = prompt
+        self.params = dict(params)
+        self.low = low
+        self.high = high
+        self.target = target
+        self.max_jobs = max_jobs
+        self.tolerance = tolerance
+        self.guidance_step = guidance_step
+        # Lowest weight that produced a scannable image so far
+        self.best = None
+        self.found = 0
+        self.jobs = 0
+
+    @property
+    def done(self):
+        return self.found >= self.target or self.jobs >= self.max_jobs
+
+    def next_weight(self):
+        if self.best is None:
+            # Nothing scanned yet, try the strongest control first
+            return self.high
+        if self.best - self.low > self.tolerance:
+            return round((self.low + self.best) / 2, 4)
+        # Converged, keep sampling new seeds just at the boundary
+        return self.best
+
+    def next_params(self):
+        if self.done:
+            return None
+        params = dict(self.params)
+        params["weight"] = str(self.next_weight())
+        return params
+
+    def report(self, params, scannable):
+        weight = float(params["weight"])
+        self.jobs += 1
+        if scannable is None:
+            # The job failed, there is nothing to learn from it
+            return
+        if scannable:
+            self.found += 1
+            self.best = weight if self.best is None else min(self.best, weight)
+        elif self.best is not None and weight < self.best:
+            self.low = max(self.low, weight)
+        elif self.best is not None:
+            # Failed at a weight that scanned before: hold the control image for
+            # longer instead of lowering the weight any further
+            guidance_end = min(1.0, float(self.params["guidance_end"]) + self.guidance_step)
+            self.params["guidance_end"] = str(round(guidance_end, 4))
+
+
+class AdaptiveSweep:
+    """
+    Feeds SweepExecutor.run() with jobs chosen by one WeightBisection per prompt.
+
+    jobs() blocks until a result has been reported, so every search keeps exactly
+    one job in flight while different prompts run concurrently. A queued sweep
+    (see job_store.JobWorker) stores first_jobs() and then the job advance()
+    returns for every finished one instead.
+    """
+
+    def __init__(self, searches, enable_hr, control_path, base_seed=-1):
+        self.searches = {search.prompt_index: search for search in searches}
+        self.enable_hr = enable_hr
+        self.control_path = control_path
+        self.base_seed = base_seed
+        self._ready = queue.Queue()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    @classmethod
+    def from_settings(cls, settings, control_path, finished=()):
+        """
+        The search of a queued sweep from its settings["adaptive"], caught up with its finished
+        jobs given as (prompt index, params, scannable or None if the job failed), oldest first.
+        """
+        searches = [
+            WeightBisection(index, prompt, settings["params"], low=settings["min_weight"],
+                            high=settings["max_weight"], target=settings["target"], max_jobs=settings["max_jobs"])
+            for index, prompt in enumerate(settings["prompts"])
+        ]
+        sweep = cls(searches, settings["enable_hr"], control_path, settings["seed"])
+        for prompt_index, params, scannable in finished:
+            sweep.searches[prompt_index].report(params, scannable)
+        return sweep
+
+    def _job(self, search):
+        params = search.next_params()
+        if params is None:
+            return None
+        seed = -1
+        if self.base_seed != -1:
+            seed = derive_seed(self.base_seed, search.prompt, {**params, "attempt": search.jobs})
+        return SweepJob(search.prompt_index, search.jobs, search.prompt, params, self.enable_hr,
+                        self.control_path, seed)
+
+    def first_jobs(self):
+        """The next job of every search that is not done yet."""
+        return [job for job in map(self._job, self.searches.values()) if job is not None]
+
+    def jobs(self):
+        # Count the first round up front so an early result cannot look like the end
+        first = self.first_jobs()
+        with self._lock:
+            self._in_flight = len(first)
+        yield from first
+        while True:
+            with self._lock:
+                if self._in_flight == 0:
+                    return
+            job = self._ready.get()
+            if job is None:
+                return
+            yield job
+
+    def advance(self, result):
+        """Records a finished SweepResult and returns the next job for its prompt, None once it is done."""
+        search = self.searches[result.job.prompt_index]
+        search.report(result.job.params, bool(result.scannable) if result.ok else None)
+        return self._job(search)
+
+    def report(self, result):
+        """Records a finished SweepResult and schedules the next job for its prompt."""
+        job = self.advance(result)
+        with self._lock:
+            if job is not None:
+                self._in_flight += 1
+            self._in_flight -= 1
+            finished = self._in_flight == 0
+        if job is not None:
+            self._ready.put(job)
+        elif finished:
+            self._ready.put(None)
+
+    def close(self):
+        """Unblocks jobs() so an abandoned run can shut down."""
+        self._ready.put(None)
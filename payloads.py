@@ -0,0 +1,64 @@
+"""
+    QR payload builders: turn the fields of each input type into the text that
+    gets encoded. Kept free of imaging dependencies so the input pages of the
+    app can use them without loading qrcode or NumPy.
+"""
+
+
+def text_payload(text=""):
+    return text
+
+
+def url_payload(url=""):
+    return url
+
+
+def email_payload(email="", subject="", body=""):
+    return f"mailto:{email}?subject={subject}&body={body}"
+
+
+def wifi_payload(ssid="", password="", encryption="WPA"):
+    return f"WIFI:T:{encryption};S:{ssid};P:{password};;"
+
+
+def vcard_payload(full_name="", organization="", address="", phone="", email="", notes=""):
+    return (
+        f"BEGIN:VCARD\n"
+        f"VERSION:3.0\n"
+        f"N:{full_name}\n"
+        f"ORG:{organization}\n"
+        f"ADR:{address}\n"
+        f"TEL:{phone}\n"
+        f"EMAIL:{email}\n"
+        f"NOTE:{notes}\n"
+        f"END:VCARD"
+    )
+
+
+# Input types as shown in the app, mapped to their payload builder
+PAYLOAD_BUILDERS = {
+    "Text": text_payload,
+    "URL": url_payload,
+    "Email": email_payload,
+    "WiFi": wifi_payload,
+    "Contact": vcard_payload,
+}
+
+
+def _builder(input_type):
+    try:
+        return PAYLOAD_BUILDERS[input_type]
+    except KeyError:
+        raise ValueError(f"Unknown QR type '{input_type}', expected one of {', '.join(PAYLOAD_BUILDERS)}")
+
+
+def payload_fields(input_type):
+    """Names of the fields the payload builder of input_type takes."""
+    code = _builder(input_type).__code__
+    return code.co_varnames[:code.co_argcount]
+
+
+def build_payload(input_type, fields):
+    """Builds the payload for input_type from a dict of fields, ignoring unknown keys."""
+    names = payload_fields(input_type)
+    return _builder(input_type)(**{name: fields[name] for name in names if fields.get(name) is not None})
@@ -0,0 +1,415 @@
+import argparse
+import hashlib
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from urllib.parse import parse_qsl, urlsplit
+
+from PIL import ImageColor
+
+from metrics import METRICS, span
+from payloads import PAYLOAD_BUILDERS, build_payload, payload_fields
+
+"""
+    Stateless HTTP API for QR generation and decoding, for other systems that
+    need these operations at request rates the Streamlit app can not serve.
+
+    GET  /v1/generate?type=WiFi&ssid=Office&password=hunter2&format=svg
+         Renders the payload built from the fields of type (see
+         payloads.PAYLOAD_BUILDERS) as PNG or SVG. Optional: color,
+         back_color, error_correction (L, M, Q, H), box_size, border.
+    POST /v1/generate
+         The same as a JSON object, fields either flat or under "fields".
+    POST /v1/decode
+         Decodes the raw image in the request body with the preprocessing
+         cascade of decoder.py and answers {"data": [...], "stage": ...}.
+    GET  /v1/types     input types and their fields
+    GET  /healthz      worker and cache state
+    GET  /metrics      Prometheus text of the process metrics
+
+    Responses are a pure function of the request, so every one carries a
+    strong ETag derived from its inputs. A matching If-None-Match is answered
+    with a 304 before anything is rendered, and rendered bodies are kept in a
+    size bounded in-memory LRU. Cache misses run in a pool of worker
+    processes: building the module matrix is pure Python and would otherwise
+    serialize every connection thread on the GIL.
+
+    Usage:
+        python qr_server.py --port 8080 --workers 4 --cache-mb 64
+"""
+
+# Part of every ETag, bump it whenever rendering or decoding output changes
+CACHE_VERSION = 2
+
+DEFAULT_CACHE_BYTES = 64 * 1024 ** 2
+MAX_BODY_BYTES = 10 * 1024 ** 2
+MAX_BOX_SIZE = 40
+MAX_BORDER = 16
+
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+ERROR_CORRECTION_LEVELS = ("L", "M", "Q", "H")
+OPTION_NAMES = ("type", "format", "color", "back_color", "error_correction", "box_size", "border")
+
+# Rendered output never changes for an ETag, so clients may keep it for good
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class ResponseCache:
+    """Size bounded LRU of response bodies. Concurrent misses on one key share a single computation."""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # key -> Future of a computation in progress
+        self._pending = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_create(self, key, create):
+        """Returns (value, True if it was not computed by this call)."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value, True
+            future = self._pending.get(key)
+            if future is not None:
+                self.hits += 1
+            else:
+                self._pending[key] = Future()
+                self.misses += 1
+        if future is not None:
+            return future.result(), True
+
+        try:
+            value = create()
+        except BaseException as e:
+            with self._lock:
+                future = self._pending.pop(key)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            future = self._pending.pop(key)
+            self._store(key, value)
+        future.set_result(value)
+        return value, False
+
+    def _store(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        self._entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.size, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+def _warm():
+    """Loads the rendering and decoding modules in a worker process."""
+    import qrgen  # noqa: F401
+    try:
+        import decoder  # noqa: F401
+    except ImportError:
+        pass
+    return os.getpid()
+
+
+def render_code(payload, fmt, color, back_color, error_correction, box_size, border):
+    """Renders payload as PNG or SVG bytes. Runs in a worker process."""
+    from qrcode.exceptions import DataOverflowError
+
+    from qrgen import ERROR_CORRECTION_LEVELS as LEVELS, render_png, render_svg
+
+    render = render_svg if fmt == "svg" else render_png
+    try:
+        return render(payload, color=color, back_color=back_color, error_correction=LEVELS[error_correction],
+                      box_size=box_size, border=border)
+    # qrcode raises a plain ValueError for data beyond version 40
+    except (DataOverflowError, ValueError):
+        raise ValueError(f"The data does not fit in a QR code at error correction {error_correction}")
+
+
+def decode_image(data):
+    """Decodes one encoded image and returns the JSON response body. Runs in a worker process."""
+    from decoder import decode_bytes
+
+    row = decode_bytes("upload", data)
+    if row["error"] == "not a readable image":
+        raise ValueError("The request body is not a readable image")
+    return json.dumps({"data": row["data"], "stage": row["stage"], "error": row["error"]}).encode()
+
+
+def _bounded_int(params, name, default, low, high):
+    value = params.get(name, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return value
+
+
+def generate_options(params):
+    """Validates generate parameters and returns (payload, render arguments after the payload)."""
+    input_type = params.get("type", "Text")
+    fields = params.get("fields")
+    if not isinstance(fields, dict):
+        fields = {name: value for name, value in params.items() if name not in OPTION_NAMES}
+    payload = build_payload(input_type, {name: str(value) for name, value in fields.items()
+                                         if value is not None})
+    if not payload:
+        raise ValueError(f"No data to encode, {input_type} takes {', '.join(payload_fields(input_type))}")
+
+    fmt = str(params.get("format", "png")).lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}', expected one of {', '.join(FORMATS)}")
+    error_correction = str(params.get("error_correction", "M")).upper()
+    if error_correction not in ERROR_CORRECTION_LEVELS:
+        raise ValueError(f"error_correction must be one of {', '.join(ERROR_CORRECTION_LEVELS)}")
+    box_size = _bounded_int(params, "box_size", 10, 1, MAX_BOX_SIZE)
+    border = _bounded_int(params, "border", 4, 0, MAX_BORDER)
+    color, back_color = str(params.get("color", "black")), str(params.get("back_color", "white"))
+    for value in (color, back_color):
+        ImageColor.getrgb(value)
+    return payload, (fmt, color, back_color, error_correction, box_size, border)
+
+
+def etag(*parts):
+    digest = hashlib.sha256(json.dumps([CACHE_VERSION, *parts]).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Idle keep-alive connections are closed after this many seconds
+    timeout = 30
+    # Headers and body go out as separate writes, with Nagle the body would wait for the delayed ACK
+    disable_nagle_algorithm = True
+
+    def _send(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload, headers=None):
+        self._send(status, "application/json", json.dumps(payload).encode(), headers)
+
+    def _send_error(self, status, message):
+        self._send_json(status, {"error": message})
+
+    def _not_modified(self, tag):
+        """Answers with a 304 if the client already has tag."""
+        header = self.headers.get("If-None-Match")
+        if not header:
+            return False
+        tags = {value.strip().removeprefix("W/") for value in header.split(",")}
+        if tag not in tags and "*" not in tags:
+            return False
+        self.send_response(304)
+        self.send_header("ETag", tag)
+        self.send_header("Cache-Control", IMMUTABLE)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return True
+
+    def _read_body(self):
+        """
+        Returns the request body, or None after answering with an error. Every error closes
+        the connection: the unread body would otherwise be parsed as the next request.
+        """
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.close_connection = True
+            self._send_error(411, "Content-Length is required")
+            return None
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self._send_error(400, "Content-Length must be a non-negative integer")
+            return None
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self._send_error(413, f"The request body is larger than {MAX_BODY_BYTES // 1024 ** 2} MB")
+            return None
+        return self.rfile.read(length)
+
+    def _cached(self, tag, stage, fn, *args):
+        """Returns the response body for tag from the cache or from fn run in the worker pool."""
+        def create():
+            with span(stage):
+                return self.server.run(fn, *args)
+
+        body, hit = self.server.cache.get_or_create(tag, create)
+        return body, {"ETag": tag, "Cache-Control": IMMUTABLE, "X-Cache": "HIT" if hit else "MISS"}
+
+    def _generate(self, params):
+        try:
+            payload, options = generate_options(params)
+        except ValueError as e:
+            self._send_error(400, str(e))
+            return
+        tag = etag("generate", payload, *options)
+        if self._not_modified(tag):
+            return
+        try:
+            body, headers = self._cached(tag, "api_render", render_code, payload, *options)
+        except ValueError as e:
+            self._send_error(400, str(e))
+            return
+        self._send(200, FORMATS[options[0]], body, headers)
+
+    def _decode(self, data):
+        if not data:
+            self._send_error(400, "The request body must be an image")
+            return
+        tag = etag("decode", hashlib.sha256(data).hexdigest())
+        if self._not_modified(tag):
+            return
+        try:
+            body, headers = self._cached(tag, "api_decode", decode_image, data)
+        except ImportError:
+            self._send_error(503, "Decoding is not available, the zbar library is not installed")
+            return
+        except ValueError as e:
+            self._send_error(400, str(e))
+            return
+        self._send(200, "application/json", body, headers)
+
+    def _dispatch(self, route):
+        started = time.perf_counter()
+        try:
+            route()
+        except Exception as e:
+            METRICS.error("api_request")
+            self._send_error(500, f"{type(e).__name__}: {e}")
+        finally:
+            METRICS.observe("api_request", time.perf_counter() - started)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/v1/generate":
+            self._dispatch(lambda: self._generate(dict(parse_qsl(url.query))))
+        elif url.path == "/v1/types":
+            self._send_json(200, {name: payload_fields(name) for name in PAYLOAD_BUILDERS})
+        elif url.path == "/healthz":
+            self._send_json(200, {"status": "ok", "workers": self.server.workers, "cache": self.server.cache.stats()})
+        elif url.path == "/metrics":
+            self._send(200, "text/plain; version=0.0.4", METRICS.prometheus_text().encode())
+        else:
+            self._send_error(404, "Not Found")
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        # Read the body even for unknown paths, to keep the connection in sync
+        data = self._read_body()
+        if data is None:
+            return
+        if path not in ("/v1/generate", "/v1/decode"):
+            self._send_error(404, "Not Found")
+            return
+        if path == "/v1/decode":
+            self._dispatch(lambda: self._decode(data))
+            return
+        try:
+            params = json.loads(data or b"{}")
+        except ValueError:
+            params = None
+        if not isinstance(params, dict):
+            self._send_error(400, "The request body must be a JSON object")
+            return
+        self._dispatch(lambda: self._generate(params))
+
+    def log_message(self, *args):
+        pass
+
+
+class QRServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, workers=None, cache_bytes=DEFAULT_CACHE_BYTES):
+        super().__init__((host, port), Handler)
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        # workers=0 renders in the connection threads, mostly useful for debugging
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn")) if self.workers else None
+        self.cache = ResponseCache(cache_bytes)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def run(self, fn, *args):
+        if self.pool is None:
+            return fn(*args)
+        return self.pool.submit(fn, *args).result()
+
+    def warm(self):
+        """Starts every worker process up front, so the first requests do not pay for it."""
+        if self.pool is not None:
+            for future in [self.pool.submit(_warm) for _ in range(self.workers)]:
+                future.result()
+        return self
+
+    def start(self):
+        """Serves from a daemon thread and returns self."""
+        threading.Thread(target=self.serve_forever, name="qr-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def server_close(self):
+        super().server_close()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP API for QR generation and decoding")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes for rendering and decoding, defaults to the CPU count")
+    parser.add_argument("--cache-mb", type=float, default=DEFAULT_CACHE_BYTES / 1024 ** 2,
+                        help="size of the in-memory response cache")
+    args = parser.parse_args(argv)
+
+    server = QRServer(args.host, args.port, args.workers, int(args.cache_mb * 1024 ** 2)).warm()
+    print(f"QR API listening on {server.url} with {server.workers} workers", file=sys.stderr)
+    # Pool workers outlive a parent that is simply killed, so SIGTERM shuts down like Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import io
+from functools import lru_cache
+
+import numpy as np
+import qrcode
+from PIL import Image, ImageColor
+
+"""
+    QR rendering, shared by the Streamlit app and the batch CLI (batch.py).
+    Nothing in here depends on Streamlit. The payload builders live in
+    payloads.py.
+
+    Rendering skips qrcode's PIL drawing: the boolean module matrix is scaled
+    up with NumPy in a single pass and written as a 1-bit PNG, or written out
+    as an SVG path in module units with every horizontal run of dark modules
+    merged into one rectangle. render_outputs produces several sizes and
+    formats from a single matrix.
+"""
+
+QR_VERSION = 1
+QR_ERROR_CORRECTION = qrcode.constants.ERROR_CORRECT_M
+QR_BOX_SIZE = 10
+QR_BORDER = 4
+
+ERROR_CORRECTION_LEVELS = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H,
+}
+
+# Target side in pixels of each output size of render_outputs. Modules are whole pixels, so
+# the side is at most the target, except for codes wider than it, drawn at one pixel per module
+OUTPUT_SIZES = {"thumbnail": 128, "screen": 512, "print": 2048}
+OUTPUT_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+def make_qr(data, error_correction=QR_ERROR_CORRECTION, box_size=QR_BOX_SIZE, border=QR_BORDER):
+    qr = qrcode.QRCode(
+        version=QR_VERSION,
+        error_correction=error_correction,
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+
+@lru_cache(maxsize=256)
+def module_matrix(data, error_correction=QR_ERROR_CORRECTION, border=QR_BORDER):
+    """Returns the boolean module matrix (True = dark) of data, quiet zone included."""
+    qr = make_qr(data, error_correction, box_size=1, border=border)
+    matrix = np.array(qr.get_matrix(), dtype=bool)
+    matrix.setflags(write=False)
+    return matrix
+
+
+def rasterize(matrix, box_size=QR_BOX_SIZE):
+    """Scales a module matrix up to pixels, box_size x box_size pixels per module."""
+    return np.repeat(np.repeat(matrix, box_size, axis=0), box_size, axis=1)
+
+
+def encode_png(pixels, color="black", back_color="white"):
+    """Writes a boolean pixel array (True = dark) as a two color, 1 bit per pixel PNG."""
+    fill, back = ImageColor.getrgb(color)[:3], ImageColor.getrgb(back_color)[:3]
+    if fill == (0, 0, 0) and back == (255, 255, 255):
+        img = Image.fromarray(~pixels)
+    else:
+        # putpalette turns the 0/1 "L" image into a two entry palette image
+        img = Image.fromarray(pixels.astype(np.uint8))
+        img.putpalette(back + fill)
+    qr_code_bytes = io.BytesIO()
+    img.save(qr_code_bytes, format='PNG', bits=1)
+    return qr_code_bytes.getvalue()
+
+
+@lru_cache(maxsize=256)
+def render_png(data, color="black", back_color="white", error_correction=QR_ERROR_CORRECTION,
+               box_size=QR_BOX_SIZE, border=QR_BORDER):
+    """Renders data as a QR code and returns the PNG bytes. Repeated calls are served from memory."""
+    matrix = module_matrix(data, error_correction, border)
+    return encode_png(rasterize(matrix, box_size), color, back_color)
+
+
+def svg_path(matrix):
+    """
+    SVG path data of the dark modules, one rectangle per horizontal run of adjacent
+    modules. Every rectangle is moved to relative to the start of the previous one,
+    which keeps the numbers short.
+    """
+    edges = np.diff(np.pad(matrix, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    starts, ends = np.argwhere(edges == 1), np.argwhere(edges == -1)
+    lengths = (ends - starts)[:, 1].tolist()
+    moves = np.diff(starts, axis=0, prepend=[[0, 0]]).tolist()
+    return "".join(f"m{dx} {dy}h{n}v1h-{n}z" for (dy, dx), n in zip(moves, lengths))
+
+
+def encode_svg(matrix, box_size=QR_BOX_SIZE, color="black", back_color="white", path=None):
+    """Writes a module matrix as an SVG in module units, displayed at box_size px per module."""
+    size = len(matrix)
+    fill, back = ("#%02x%02x%02x" % ImageColor.getrgb(c)[:3] for c in (color, back_color))
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size * box_size}" height="{size * box_size}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="{back}"/>'
+        f'<path fill="{fill}" d="{path or svg_path(matrix)}"/></svg>'
+    ).encode()
+
+
+@lru_cache(maxsize=256)
+def render_svg(data, color="black", back_color="white", error_correction=QR_ERROR_CORRECTION,
+               box_size=QR_BOX_SIZE, border=QR_BORDER):
+    """Renders data as a QR code and returns the SVG bytes."""
+    return encode_svg(module_matrix(data, error_correction, border), box_size, color, back_color)
+
+
+def output_box_size(matrix, size):
+    """
+    Pixels per module that keep the code within the named output size, and 1 for codes with
+    more modules than that size has pixels: those come out larger than the target.
+    """
+    return max(1, OUTPUT_SIZES[size] // len(matrix))
+
+
+def render_outputs(data, formats=("png",), sizes=("screen",), color="black", back_color="white",
+                   error_correction=QR_ERROR_CORRECTION, border=QR_BORDER):
+    """
+    Renders data in every requested format and size and returns {(size, format): bytes}.
+    Sizes are targets rather than limits, see output_box_size().
+    The module matrix and the SVG path are computed once and shared by all outputs.
+    """
+    matrix = module_matrix(data, error_correction, border)
+    path = svg_path(matrix) if "svg" in formats else None
+    outputs = {}
+    for size in sizes:
+        box_size = output_box_size(matrix, size)
+        for fmt in formats:
+            if fmt == "svg":
+                outputs[size, fmt] = encode_svg(matrix, box_size, color, back_color, path)
+            else:
+                outputs[size, fmt] = encode_png(rasterize(matrix, box_size), color, back_color)
+    return outputs
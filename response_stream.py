@@ -0,0 +1,220 @@
+import base64
+import binascii
+import json
+import time
+
+from metrics import METRICS, observe_bytes
+
+"""
+    Incremental parser for txt2img responses.
+
+    A txt2img response is one JSON object holding multi-MB base64 strings: the
+    generated "images" and, under "parameters", an echo of the request body with
+    the control image. Parsing it with response.json() keeps the whole text plus
+    every decoded string in memory. This parser reads the body chunk by chunk,
+    base64-decodes images straight into their sinks and skips everything except
+    "info" without building any Python objects for it.
+"""
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = b" \t\r\n"
+
+
+class ImageSink:
+    """Collects the PNG bytes of one image and optionally writes them to path as they arrive."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._file = open(path, "wb") if path else None
+        self._parts = []
+        self.data = None
+        # Time spent in file writes, reported as the disk_write stage on close
+        self.write_seconds = 0.0
+
+    def write(self, data):
+        self._parts.append(data)
+        if self._file:
+            started = time.perf_counter()
+            self._file.write(data)
+            self.write_seconds += time.perf_counter() - started
+
+    def close(self):
+        if self._file:
+            started = time.perf_counter()
+            self._file.close()
+            self.write_seconds += time.perf_counter() - started
+            METRICS.observe("disk_write", self.write_seconds)
+        self.data = b"".join(self._parts)
+        self._parts = []
+        observe_bytes("image", len(self.data))
+
+
+class _Base64Writer:
+    """Decodes a stream of base64 text into a sink, 4 characters at a time."""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.pending = b""
+        self.started = False
+
+    def write(self, text):
+        if self.sink is None:
+            return
+        # Chunks never split an escape, so "\/" can be unescaped per chunk
+        text = self.pending + text.replace(b"\\/", b"/")
+        if not self.started:
+            # Strip an optional data URI prefix ("data:image/png;base64,")
+            if text.startswith(b"data:") or b"data:".startswith(text):
+                comma = text.find(b",")
+                if comma < 0:
+                    self.pending = text
+                    return
+                text = text[comma + 1:]
+            self.started = True
+        usable = len(text) - len(text) % 4
+        if usable:
+            self.sink.write(base64.b64decode(text[:usable]))
+        self.pending = text[usable:]
+
+    def close(self):
+        if self.sink is None:
+            return
+        if self.pending:
+            try:
+                self.sink.write(base64.b64decode(self.pending + b"=" * (-len(self.pending) % 4)))
+            except binascii.Error:
+                pass
+        self.sink.close()
+
+
+class _Reader:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buf = b""
+        self.pos = 0
+
+    def _fill(self):
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            raise ValueError("Unexpected end of txt2img response")
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        while True:
+            while self.pos >= len(self.buf):
+                self._fill()
+            if self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+                continue
+            return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Malformed txt2img response, expected {char!r}")
+        self.pos += 1
+
+    def string_chunks(self):
+        """Yields the raw (still escaped) contents of the string at the cursor."""
+        self.expect(b'"')
+        while True:
+            quote = self.buf.find(b'"', self.pos)
+            if quote < 0:
+                end = len(self.buf)
+                # Never split an escape sequence between chunks
+                while end > self.pos and self.buf[end - 1:end] == b"\\":
+                    end -= 1
+                if end > self.pos:
+                    yield self.buf[self.pos:end]
+                self.pos = end
+                self._fill()
+                continue
+            backslashes = 0
+            while quote - backslashes - 1 >= self.pos and self.buf[quote - backslashes - 1] == 0x5c:
+                backslashes += 1
+            if backslashes % 2:
+                # Escaped quote, part of the string
+                yield self.buf[self.pos:quote + 1]
+                self.pos = quote + 1
+                continue
+            if quote > self.pos:
+                yield self.buf[self.pos:quote]
+            self.pos = quote + 1
+            return
+
+    def string(self):
+        return json.loads(b'"' + b"".join(self.string_chunks()) + b'"')
+
+    def skip_value(self):
+        char = self.peek()
+        if char == b'"':
+            for _ in self.string_chunks():
+                pass
+        elif char in (b"{", b"["):
+            close = b"}" if char == b"{" else b"]"
+            self.pos += 1
+            if self.peek() == close:
+                self.pos += 1
+                return
+            while True:
+                if char == b"{":
+                    self.string()
+                    self.expect(b":")
+                self.skip_value()
+                if self.peek() == close:
+                    self.pos += 1
+                    return
+                self.expect(b",")
+        else:
+            # number, true, false or null
+            while True:
+                while self.pos >= len(self.buf):
+                    try:
+                        self._fill()
+                    except ValueError:
+                        return
+                if self.buf[self.pos:self.pos + 1] in b",}] \t\r\n":
+                    return
+                self.pos += 1
+
+
+def parse_txt2img(chunks, sink_for_image):
+    """
+    Parses a txt2img response body given as an iterable of byte chunks.
+
+    sink_for_image(index) returns an ImageSink for the index-th image, or None to
+    skip it (for example the control maps ControlNet appends after the result).
+    Returns {"images": [sinks], "info": info string or None}.
+    """
+    reader = _Reader(chunks)
+    result = {"images": [], "info": None}
+    reader.expect(b"{")
+    if reader.peek() == b"}":
+        return result
+    while True:
+        key = reader.string()
+        reader.expect(b":")
+        if key == "images" and reader.peek() == b"[":
+            reader.expect(b"[")
+            index = 0
+            while reader.peek() != b"]":
+                sink = sink_for_image(index)
+                writer = _Base64Writer(sink)
+                try:
+                    for text in reader.string_chunks():
+                        writer.write(text)
+                finally:
+                    writer.close()
+                if sink is not None:
+                    result["images"].append(sink)
+                index += 1
+                if reader.peek() == b",":
+                    reader.pos += 1
+            reader.expect(b"]")
+        elif key == "info" and reader.peek() == b'"':
+            result["info"] = reader.string()
+        else:
+            reader.skip_value()
+        if reader.peek() == b"}":
+            return result
+        reader.expect(b",")
@@ -0,0 +1,119 @@
+import json
+import os
+import shutil
+import threading
+
+"""
+    Content-addressed on-disk cache for generated images.
+
+    Entries are keyed by ControlnetRequest.cache_key(), which hashes every field
+    that influences the render (prompt, negative prompt, control image hash,
+    model, seed and all sd / controlnet settings). Only requests with a fixed
+    seed are reproducible, so only those should be cached. Entries are evicted
+    least recently used first once the cache grows past max_bytes.
+"""
+
+DEFAULT_CACHE_DIR = os.environ.get("QR_RESULT_CACHE", os.path.join(os.getcwd(), ".cache", "results"))
+DEFAULT_MAX_BYTES = int(os.environ.get("QR_RESULT_CACHE_BYTES", 2 * 1024 ** 3))
+
+
+class ResultCache:
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key, ext):
+        return os.path.join(self.root, key[:2], f"{key}.{ext}")
+
+    def _entries(self):
+        """Yields (key, size in bytes, last used time) for every cached image."""
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if not filename.endswith(".png"):
+                    continue
+                key = filename[:-4]
+                try:
+                    stat = os.stat(os.path.join(dirpath, filename))
+                    meta_size = os.path.getsize(self._path(key, "json"))
+                except OSError:
+                    continue
+                yield key, stat.st_size + meta_size, stat.st_mtime
+
+    def get(self, key):
+        """Returns (image path, metadata) for key, or None on a miss."""
+        image_path = self._path(key, "png")
+        try:
+            with open(self._path(key, "json")) as f:
+                meta = json.load(f)
+            # Touch the entry so eviction sees it as recently used
+            os.utime(image_path)
+        except (OSError, ValueError):
+            return None
+        return image_path, meta
+
+    def copy_to(self, key, path):
+        """Copies the cached image for key to path. Returns the metadata, or None on a miss."""
+        entry = self.get(key)
+        if entry is None:
+            return None
+        try:
+            shutil.copyfile(entry[0], path)
+        except OSError:
+            return None
+        return entry[1]
+
+    def _entry_size(self, key):
+        """Size in bytes of the image and metadata cached for key, 0 if there is no complete entry."""
+        try:
+            return os.path.getsize(self._path(key, "png")) + os.path.getsize(self._path(key, "json"))
+        except OSError:
+            return 0
+
+    def put_file(self, key, image_path, meta):
+        """Stores a copy of the image at image_path under key, replacing any previous entry."""
+        target = self._path(key, "png")
+        meta_target = self._path(key, "json")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{threading.get_ident()}.tmp"
+        meta_tmp = f"{meta_target}.{threading.get_ident()}.tmp"
+        shutil.copyfile(image_path, tmp)
+        with open(meta_tmp, "w") as f:
+            json.dump(meta, f)
+        added = os.path.getsize(tmp) + os.path.getsize(meta_tmp)
+        with self._lock:
+            # Replaced under the lock so the size of an overwritten entry is only subtracted once
+            added -= self._entry_size(key)
+            os.replace(tmp, target)
+            os.replace(meta_tmp, meta_target)
+            self._size += added
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if self._size <= self.max_bytes:
+                break
+            for ext in ("png", "json"):
+                try:
+                    os.remove(self._path(key, ext))
+                except OSError:
+                    pass
+            self._size -= size
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Returns the process wide ResultCache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
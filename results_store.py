@@ -0,0 +1,100 @@
+import io
+import json
+import os
+import threading
+
+from PIL import Image
+
+from metrics import span
+
+"""
+    Sidecar files for sweep results, and the index the gallery pages through.
+
+    Next to every generated gen_image_{i}_{j}.png the executor writes
+    - gen_image_{i}_{j}.thumb.jpg, a small JPEG the gallery shows instead of
+      the full image
+    - gen_image_{i}_{j}.json, the prompt, parameters, seed, timings and scan
+      result of the job
+    so a sweep folder describes itself and the page never has to send full
+    size images unless one is asked for.
+"""
+
+THUMBNAIL_SIZE = (256, 256)
+THUMBNAIL_QUALITY = 85
+
+
+def sidecar_paths(image_path):
+    """Returns the (thumbnail, metadata) paths for the image at image_path."""
+    base = os.path.splitext(image_path)[0]
+    return f"{base}.thumb.jpg", f"{base}.json"
+
+
+def write_sidecars(image_path, meta, image_bytes=None):
+    """Writes the thumbnail and metadata sidecar of an image, from image_bytes when the caller has them."""
+    thumbnail_path, meta_path = sidecar_paths(image_path)
+    with span("thumbnail"):
+        img = Image.open(io.BytesIO(image_bytes) if image_bytes else image_path)
+        img.thumbnail(THUMBNAIL_SIZE)
+        img.convert("RGB").save(thumbnail_path, format="JPEG", quality=THUMBNAIL_QUALITY)
+    meta = {**meta, "image": os.path.basename(image_path), "thumbnail": os.path.basename(thumbnail_path)}
+    # The metadata goes last, its presence marks a complete entry
+    tmp = f"{meta_path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path)
+
+
+class ResultsStore:
+    """Index of the sidecars in one output folder, refreshed incrementally."""
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self._lock = threading.Lock()
+        # metadata file name -> (mtime, metadata)
+        self._entries = {}
+
+    def refresh(self):
+        """Loads new or rewritten metadata files and drops removed ones."""
+        try:
+            scanned = {entry.name: entry.stat().st_mtime_ns for entry in os.scandir(self.out_dir)
+                       if entry.name.endswith(".json")}
+        except OSError:
+            scanned = {}
+        with self._lock:
+            for name in set(self._entries) - set(scanned):
+                del self._entries[name]
+            for name, mtime in scanned.items():
+                known = self._entries.get(name)
+                if known is not None and known[0] == mtime:
+                    continue
+                try:
+                    with open(os.path.join(self.out_dir, name)) as f:
+                        self._entries[name] = (mtime, json.load(f))
+                except (OSError, ValueError):
+                    continue
+            return [meta for _, meta in self._entries.values()]
+
+    def prompts(self):
+        return sorted({meta.get("prompt", "") for meta in self.refresh()})
+
+    def query(self, prompt=None, scannable="any", newest_first=True, page=0, page_size=24):
+        """
+        Returns (entries of the page, number of matching entries).
+
+        scannable is "any", "yes", "no" or "unchecked". Every entry gets absolute
+        "image_path" and "thumbnail_path" keys.
+        """
+        wanted = {"yes": True, "no": False, "unchecked": None}
+        entries = [
+            meta for meta in self.refresh()
+            if (prompt is None or meta.get("prompt") == prompt)
+            and (scannable == "any" or meta.get("scannable") == wanted[scannable])
+        ]
+        entries.sort(key=lambda meta: meta.get("finished_at", 0), reverse=newest_first)
+        start = page * page_size
+        rows = [
+            {**meta, "image_path": os.path.join(self.out_dir, meta["image"]),
+             "thumbnail_path": os.path.join(self.out_dir, meta["thumbnail"])}
+            for meta in entries[start:start + page_size]
+        ]
+        return rows, len(entries)
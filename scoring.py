@@ -0,0 +1,156 @@
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+from qrgen import QR_BORDER, QR_ERROR_CORRECTION, module_matrix
+
+"""
+    Cheap scannability score for generated AI QR images.
+
+    The module grid is read from the control image the sweep used (see
+    control_layout), or rebuilt from the payload with the default qrgen
+    settings, then the generated image is sampled at every module center in
+    one vectorized pass. The score is meant as a pre-filter in
+    front of pyzbar: it is continuous, so results can also be ranked by it.
+"""
+
+FINDER_SIZE = 7
+
+# Full image, as (top, left, height, width) fractions
+FULL_REGION = (0.0, 0.0, 1.0, 1.0)
+
+
+def finder_mask(size, border=QR_BORDER):
+    """Marks the three 7x7 finder patterns of a size x size matrix."""
+    mask = np.zeros((size, size), dtype=bool)
+    far = size - border - FINDER_SIZE
+    for row, col in ((border, border), (border, far), (far, border)):
+        mask[row:row + FINDER_SIZE, col:col + FINDER_SIZE] = True
+    return mask
+
+
+class ScanScore:
+    def __init__(self, agreement, finder, margin):
+        # Fraction of modules on the right side of the threshold
+        self.agreement = agreement
+        # Same, only over the finder patterns
+        self.finder = finder
+        # Mean signed distance from the threshold, in 0-1 luminance units
+        self.margin = margin
+
+    @property
+    def score(self):
+        """Single 0-1 number used for ranking, finder damage weighs the most."""
+        margin = min(max(self.margin * 2, 0.0), 1.0)
+        return self.agreement * self.finder * (0.5 + 0.5 * margin)
+
+    def passes(self, min_agreement=0.8, min_finder=0.9):
+        """Conservative pre-filter, images failing it are very unlikely to decode."""
+        return self.agreement >= min_agreement and self.finder >= min_finder
+
+    def as_dict(self):
+        return {"score": round(self.score, 4), "agreement": round(self.agreement, 4),
+                "finder": round(self.finder, 4), "margin": round(self.margin, 4)}
+
+
+def _load_gray(image):
+    if isinstance(image, np.ndarray):
+        gray = image if image.ndim == 2 else image[..., :3].mean(axis=2)
+        return gray.astype(np.float32) / 255
+    if not isinstance(image, Image.Image):
+        with Image.open(image) as opened:
+            return np.asarray(opened.convert("L"), dtype=np.float32) / 255
+    return np.asarray(image.convert("L"), dtype=np.float32) / 255
+
+
+class ControlLayout:
+    def __init__(self, matrix, region):
+        # Boolean module matrix (True = dark) without the quiet zone
+        self.matrix = matrix
+        # Where the code sits in the image, as (top, left, height, width) fractions
+        self.region = region
+
+
+def control_layout(image):
+    """
+    Reads the module grid of a clean control image, or returns None if it does not
+    look like a QR code. Works for any module size and quiet zone, so generated
+    images can be scored against whatever control image they were rendered from.
+    """
+    dark = _load_gray(image) < 0.5
+    rows, cols = np.flatnonzero(dark.any(axis=1)), np.flatnonzero(dark.any(axis=0))
+    if not rows.size:
+        return None
+    top, left = rows[0], cols[0]
+    side = min(rows[-1] + 1 - top, cols[-1] + 1 - left)
+    # The top left finder pattern starts with a run of 7 dark modules
+    run = int(np.argmin(dark[top, left:left + side]))
+    if run == 0:
+        return None
+    modules = round(side * FINDER_SIZE / run)
+    if modules < 21 or (modules - 17) % 4:
+        return None
+    centers = ((np.arange(modules) + 0.5) * side / modules).astype(int)
+    matrix = dark[top + centers[:, None], left + centers[None, :]]
+    height, width = dark.shape
+    return ControlLayout(matrix, (float(top / height), float(left / width), float(side / height), float(side / width)))
+
+
+@lru_cache(maxsize=16)
+def _cached_layout(path, mtime_ns):
+    return control_layout(path)
+
+
+def load_control_layout(path):
+    """control_layout of the image at path, read once per file version."""
+    return _cached_layout(os.path.abspath(path), os.stat(path).st_mtime_ns)
+
+
+def sample_modules(gray, size, patch=3, region=FULL_REGION):
+    """Mean luminance of a patch x patch window around each module center of a size x size grid over region."""
+    height, width = gray.shape
+    top, left, region_height, region_width = region
+    offsets = np.arange(patch) - patch // 2
+    ys = ((top + (np.arange(size) + 0.5) * region_height / size) * height).astype(int)
+    xs = ((left + (np.arange(size) + 0.5) * region_width / size) * width).astype(int)
+    ys = np.clip(ys[:, None] + offsets, 0, height - 1)
+    xs = np.clip(xs[:, None] + offsets, 0, width - 1)
+    samples = gray[ys[:, None, :, None], xs[None, :, None, :]]
+    return samples.mean(axis=(2, 3))
+
+
+def score_image(image, payload, error_correction=QR_ERROR_CORRECTION, border=QR_BORDER, layout=None):
+    """
+    Scores how well a generated image reproduces the QR modules of payload, or of
+    the control image layout if one is given.
+    """
+    if layout is not None:
+        matrix, region, border = layout.matrix, layout.region, 0
+    else:
+        matrix, region = module_matrix(payload, error_correction, border), FULL_REGION
+    size = matrix.shape[0]
+    values = sample_modules(_load_gray(image), size, region=region)
+
+    dark, light = values[matrix], values[~matrix]
+    threshold = (dark.mean() + light.mean()) / 2
+    # Positive when the module sits on the expected side of the threshold
+    signed = np.where(matrix, threshold - values, values - threshold)
+
+    finders = finder_mask(size, border)
+    return ScanScore(
+        agreement=float((signed > 0).mean()),
+        finder=float((signed[finders] > 0).mean()),
+        margin=float(signed.mean()),
+    )
+
+
+def score_directory(directory, payload, pattern="gen_image_*.png", workers=None, layout=None):
+    """Scores every matching image in directory, best first, as (path, ScanScore) pairs."""
+    paths = sorted(glob.glob(os.path.join(directory, pattern)))
+    with ThreadPoolExecutor(workers) as pool:
+        scores = list(pool.map(lambda path: score_image(path, payload, layout=layout), paths))
+    return sorted(zip(paths, scores), key=lambda item: item[1].score, reverse=True)
@@ -0,0 +1,353 @@
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from controlnet import BODY_TEMPLATE, ControlnetRequest, response_seeds
+from metrics import METRICS, span
+from response_stream import ImageSink
+from results_store import write_sidecars
+
+"""
+    Pipelined executor for prompt x parameter sweeps.
+
+    A sweep job goes through two stages:
+    1. build the txt2img body, wait on the webui and stream the PNG bytes of
+       the result straight to disk (network bound). Consecutive jobs that only
+       differ by (consecutive) seed, such as the repeats of one combination,
+       are sent as one request with batch_size / n_iter and the images are
+       split back into their per-job files.
+    2. cache and scan the saved image and write its thumbnail and metadata
+       sidecars (CPU / disk bound)
+    Each stage gets its own bounded thread pool so the GPU is kept busy while
+    earlier results are still being cached and scanned. cancel() stops feeding
+    jobs, and jobs not sent yet (or answered after the cancel, with the partial
+    image of an interrupted render) finish with a JobCancelled error.
+"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# Rough fp16 SD 1.5 + ControlNet figures, used to turn a VRAM budget into a batch size
+BASE_VRAM_GB = 4.0
+VRAM_GB_PER_MEGAPIXEL = 2.0
+
+
+class SweepJob:
+    def __init__(self, prompt_index, param_index, prompt, params, enable_hr, control_path, seed=-1, repeat=0):
+        self.prompt_index = prompt_index
+        self.param_index = param_index
+        self.prompt = prompt
+        self.params = params
+        self.enable_hr = enable_hr
+        self.control_path = control_path
+        # -1 lets the webui pick a random seed
+        self.seed = seed
+        # Index of the image among the repeats of the same prompt and parameters
+        self.repeat = repeat
+        # Set when the job comes from a JobStore
+        self.job_id = None
+
+    @property
+    def file_name(self):
+        if self.repeat:
+            return f"gen_image_{self.prompt_index}_{self.param_index}_{self.repeat}.png"
+        return f"gen_image_{self.prompt_index}_{self.param_index}.png"
+
+
+class SweepResult:
+    def __init__(self, job, path=None, error=None, elapsed=0.0, seed=None, cached=False, scannable=None,
+                 image_bytes=None):
+        self.job = job
+        self.path = path
+        # PNG bytes as written to path, so the UI does not have to read the file back
+        self.image_bytes = image_bytes
+        self.error = error
+        self.elapsed = elapsed
+        # Seed the image was actually rendered with
+        self.seed = seed
+        self.cached = cached
+        # Set by the executor's scan callback, None when no scan was run
+        self.scannable = scannable
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def derive_seed(base_seed, prompt, params):
+    """Derives a stable per-job seed from base_seed, the prompt and its parameters."""
+    key = json.dumps([base_seed, prompt, params], sort_keys=True)
+    return int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest()[:4], "big") & 0x7fffffff
+
+
+def build_jobs(prompts, list_of_params_to_run, enable_hr, control_path, base_seed=-1, repeats=1):
+    """
+    Expands prompts x parameter combinations into sweep jobs, repeats images each.
+
+    With a base_seed of -1 every job gets a random seed, otherwise each job gets a
+    seed derived from base_seed so reruns of the same sweep are reproducible. The
+    repeats of a combination get consecutive seeds, the way the webui seeds a batch.
+    """
+    for index, prompt in enumerate(prompts):
+        for index_2, params in enumerate(list_of_params_to_run):
+            seed = -1 if base_seed == -1 else derive_seed(base_seed, prompt, params)
+            for repeat in range(repeats):
+                yield SweepJob(index, index_2, prompt, params, enable_hr, control_path,
+                               seed if seed == -1 else (seed + repeat) & 0x7fffffff, repeat)
+
+
+def max_batch_for_vram(vram_gb, enable_hr, width=BODY_TEMPLATE["width"], height=BODY_TEMPLATE["height"],
+                       hr_scale=BODY_TEMPLATE["hr_scale"]):
+    """Images per batch that fit a VRAM budget in GB, 1 without a budget."""
+    if not vram_gb:
+        return 1
+    megapixels = width * height / 1e6 * (hr_scale ** 2 if enable_hr else 1)
+    return max(1, int((vram_gb - BASE_VRAM_GB) // (megapixels * VRAM_GB_PER_MEGAPIXEL)))
+
+
+def batchable(batch, job):
+    """Whether job can be rendered in the same txt2img request as the jobs in batch."""
+    lead = batch[0]
+    if (job.prompt, job.control_path, job.enable_hr, job.params) != (lead.prompt, lead.control_path,
+                                                                     lead.enable_hr, lead.params):
+        return False
+    # The webui seeds the images of a batch seed, seed + 1, ...
+    return job.seed == lead.seed == -1 or (lead.seed != -1 and job.seed == lead.seed + len(batch))
+
+
+def split_batch(jobs, max_batch):
+    """
+    Splits the jobs of a batch into requests: one with as many full batches of max_batch
+    as fit (as n_iter iterations), then one with the rest, so 7 images with a max_batch
+    of 4 are sent as 4 + 3 instead of seven batches of one.
+    """
+    full = len(jobs) - len(jobs) % max_batch
+    return [part for part in (jobs[:full], jobs[full:]) if part]
+
+
+def batch_shape(count, max_batch):
+    """(batch_size, n_iter) for count images, a multiple of max_batch or fewer (see split_batch)."""
+    batch_size = min(count, max_batch)
+    return batch_size, count // batch_size
+
+
+def build_request(job, transport=None):
+    """Creates the ControlnetRequest for a single sweep job."""
+    control_net = ControlnetRequest(job.prompt, job.control_path, transport)
+    control_net.build_body()
+    control_net.update_sd({
+        "steps": int(job.params["steps"]),
+        "enable_hr": job.enable_hr,
+        "hr_second_pass_steps": int(job.params["hr_second_pass_steps"]),
+        "seed": job.seed}
+    )
+    control_net.update_cn({
+        "weight": float(job.params["weight"]),
+        "guidance_start": float(job.params["guidance_start"]),
+        "guidance_end": float(job.params["guidance_end"])
+    })
+    return control_net
+
+
+def build_batch_request(jobs, transport=None, max_batch=1):
+    """Creates one ControlnetRequest rendering every job of a batch, in order."""
+    control_net = build_request(jobs[0], transport)
+    if len(jobs) > 1:
+        batch_size, n_iter = batch_shape(len(jobs), max_batch)
+        # Without the grid image the response holds exactly one image per job
+        control_net.update_sd({"batch_size": batch_size, "n_iter": n_iter,
+                               "override_settings": {"return_grid": False}})
+    return control_net
+
+
+class SweepExecutor:
+    def __init__(self, http_workers=2, io_workers=2, max_pending=None, transport=None, cache=None, scan=None,
+                 sidecars=True, max_batch=1, max_iter=1):
+        self.transport = transport
+        # Write a thumbnail and a metadata file next to every image (see results_store)
+        self.sidecars = sidecars
+        # Optional ResultCache, consulted for jobs with a fixed seed
+        self.cache = cache
+        # Optional callable(job, path) run in the io pool on every saved image,
+        # its return value is stored as SweepResult.scannable
+        self.scan = scan
+        self.http_workers = max(1, int(http_workers))
+        self.io_workers = max(1, int(io_workers))
+        # Images rendered at once (batch_size, bounded by VRAM) and batches per
+        # request (n_iter). Above 1 the feeder looks one job ahead to build a
+        # batch, so the job iterator must not wait on earlier results.
+        self.max_batch = max(1, int(max_batch))
+        self.max_iter = max(1, int(max_iter))
+        self.max_group = self.max_batch * self.max_iter
+        # Limits how many jobs are built / in flight at once so a large grid
+        # never holds every request body in memory.
+        self.max_pending = max(max_pending or self.http_workers * 2 * self.max_group, self.max_group)
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _scan(self, job, path):
+        if not self.scan:
+            return None
+        with span("scan"):
+            return self.scan(job, path)
+
+    def _record(self, result, image_bytes=None):
+        """Writes the sidecars of a finished result."""
+        if not self.sidecars:
+            return
+        job = result.job
+        write_sidecars(result.path, {
+            "prompt": job.prompt, "prompt_index": job.prompt_index, "param_index": job.param_index,
+            "repeat": job.repeat, "params": job.params, "enable_hr": job.enable_hr, "requested_seed": job.seed,
+            "seed": result.seed, "cached": result.cached, "scannable": result.scannable,
+            "elapsed": round(result.elapsed, 3), "finished_at": time.time(),
+        }, image_bytes)
+
+    def run(self, jobs, out_dir):
+        """Runs the jobs and yields a SweepResult for each one in completion order."""
+        results = queue.Queue()
+        slots = threading.Semaphore(self.max_pending)
+        http_pool = ThreadPoolExecutor(self.http_workers, thread_name_prefix="sweep-http")
+        io_pool = ThreadPoolExecutor(self.io_workers, thread_name_prefix="sweep-io")
+        submitted = [0]
+        stop = threading.Event()
+
+        def finish(result):
+            slots.release()
+            results.put(result)
+
+        def save_stage(batch, output, paths, cache_keys, started):
+            seeds = response_seeds(output)
+            for index, job in enumerate(batch):
+                try:
+                    seed = seeds[index] if index < len(seeds) else None
+                    if cache_keys[index] is not None:
+                        with span("cache_write"):
+                            self.cache.put_file(cache_keys[index], paths[index], {"seed": seed, "info": output.get("info")})
+                    scannable = self._scan(job, paths[index])
+                    result = SweepResult(job, path=paths[index], elapsed=time.perf_counter() - started, seed=seed,
+                                         scannable=scannable, image_bytes=output["images"][index].data)
+                    self._record(result, result.image_bytes)
+                    finish(result)
+                except Exception as e:
+                    METRICS.error("job")
+                    finish(SweepResult(job, error=e, elapsed=time.perf_counter() - started))
+
+        def from_cache(job, path, started):
+            """Finishes job from the result cache, returns its cache key (None if it is not cacheable) and hit."""
+            if self.cache is None or job.seed == -1:
+                return None, False
+            cache_key = build_request(job, self.transport).cache_key()
+            with span("cache_read"):
+                meta = self.cache.copy_to(cache_key, path)
+            if meta is None:
+                return cache_key, False
+            result = SweepResult(job, path=path, elapsed=time.perf_counter() - started,
+                                 seed=meta.get("seed"), cached=True, scannable=self._scan(job, path))
+            self._record(result)
+            finish(result)
+            return cache_key, True
+
+        def render(batch, cache_keys, started):
+            paths = [os.path.join(out_dir, job.file_name) for job in batch]
+            try:
+                control_net = build_batch_request(batch, self.transport, self.max_batch)
+                METRICS.observe_bytes("batch_images", len(batch))
+                # The first len(batch) images are the results, ControlNet appends its control maps
+                output = control_net.send_request_stream(
+                    lambda index: ImageSink(paths[index]) if index < len(batch) else None)
+                if self._cancelled.is_set():
+                    raise JobCancelled("Cancelled while rendering")
+                if len(output["images"]) < len(batch):
+                    raise ValueError(f"txt2img response contained {len(output['images'])} images, expected {len(batch)}")
+            except Exception as e:
+                # Do not leave half written images behind
+                for path in paths:
+                    if os.path.exists(path):
+                        os.remove(path)
+                for job in batch:
+                    if not isinstance(e, JobCancelled):
+                        METRICS.error("job")
+                    finish(SweepResult(job, error=e, elapsed=time.perf_counter() - started))
+                return
+            io_pool.submit(save_stage, batch, output, paths, cache_keys, started)
+
+        def http_stage(batch):
+            started = time.perf_counter()
+            if self._cancelled.is_set():
+                for job in batch:
+                    finish(SweepResult(job, error=JobCancelled("Cancelled before it was sent")))
+                return
+            # Jobs still to render, split wherever a cache hit breaks the seed sequence
+            runs, cache_keys = [[]], [[]]
+            for job in batch:
+                try:
+                    cache_key, hit = from_cache(job, os.path.join(out_dir, job.file_name), started)
+                except Exception as e:
+                    METRICS.error("job")
+                    finish(SweepResult(job, error=e, elapsed=time.perf_counter() - started))
+                    hit, cache_key = True, None
+                if hit:
+                    if runs[-1]:
+                        runs.append([])
+                        cache_keys.append([])
+                    continue
+                runs[-1].append(job)
+                cache_keys[-1].append(cache_key)
+            for run, keys in zip(runs, cache_keys):
+                start = 0
+                for part in split_batch(run, self.max_batch):
+                    render(part, keys[start:start + len(part)], started)
+                    start += len(part)
+
+        def feed():
+            batch = []
+            try:
+                for job in jobs:
+                    slots.acquire()
+                    if stop.is_set() or self._cancelled.is_set():
+                        slots.release()
+                        break
+                    if batch and not batchable(batch, job):
+                        http_pool.submit(http_stage, batch)
+                        batch = []
+                    batch.append(job)
+                    submitted[0] += 1
+                    if len(batch) >= self.max_group:
+                        http_pool.submit(http_stage, batch)
+                        batch = []
+            finally:
+                if batch:
+                    http_pool.submit(http_stage, batch)
+                results.put(None)
+
+        feeder = threading.Thread(target=feed, name="sweep-feeder", daemon=True)
+        feeder.start()
+
+        received = 0
+        try:
+            while True:
+                item = results.get()
+                if item is None:
+                    # The feeder is done; drain whatever is still in flight.
+                    while received < submitted[0]:
+                        yield results.get()
+                        received += 1
+                    break
+                received += 1
+                yield item
+        finally:
+            stop.set()
+            # Unblock the feeder if it is waiting on a slot.
+            slots.release()
+            feeder.join()
+            http_pool.shutdown(wait=True)
+            io_pool.shutdown(wait=True)
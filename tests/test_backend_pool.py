@@ -0,0 +1,119 @@
+import socket
+import time
+
+import pytest
+import requests
+
+from backend_pool import MAX_FAILURES, Backend, BackendPool, NoBackendAvailable
+from mock_a1111 import MockA1111, MockSettings
+from transport import Transport
+
+BODY = {"prompt": "test", "width": 8, "height": 8}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def backend(url, concurrency=2, weight=1.0):
+    node = Backend(url, concurrency, weight)
+    # No transport retries, so failures reach the pool right away
+    node.transport = Transport(url, retries=0, connect_timeout=1)
+    return node
+
+
+def passed_check(node):
+    """Marks node as healthy at its last health check, without reaching it."""
+    node.healthy = True
+    node.checked_at = time.monotonic()
+
+
+@pytest.fixture
+def mocks():
+    servers = []
+
+    def start(port=0, **settings):
+        server = MockA1111(port=port, settings=MockSettings(latency=0.0, **settings)).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def test_least_loaded_routing(mocks):
+    light, heavy = mocks(), mocks()
+    pool = BackendPool([backend(heavy.url, concurrency=4), backend(light.url, concurrency=4, weight=2.0)])
+    acquired = [pool.acquire(BODY) for _ in range(6)]
+    # The node with twice the weight takes twice the jobs
+    assert [node.url for node in acquired].count(light.url) == 4
+    for node in acquired:
+        pool.release(node)
+    assert all(node.in_flight == 0 for node in pool.backends)
+
+
+def test_waits_for_a_free_node(mocks):
+    pool = BackendPool([backend(mocks().url, concurrency=1)], acquire_timeout=0.5)
+    node = pool.acquire(BODY)
+    with pytest.raises(NoBackendAvailable):
+        pool.acquire(BODY)
+    pool.release(node)
+    assert pool.acquire(BODY) is node
+
+
+def test_failover_on_server_error(mocks):
+    failing, working = mocks(failure_rate=1.0), mocks()
+    pool = BackendPool([backend(failing.url), backend(working.url)])
+    for _ in range(MAX_FAILURES + 1):
+        assert pool.post("/sdapi/v1/txt2img", json=BODY).json()["images"]
+    assert failing.settings.requests and working.settings.requests == MAX_FAILURES + 1
+    # The failing node answered, so it stays in rotation
+    assert pool.backends[0].healthy and pool.backends[0].failures == 0
+
+
+def test_failover_on_connection_error(mocks):
+    working = mocks()
+    dead = backend(f"http://127.0.0.1:{free_port()}")
+    pool = BackendPool([dead, backend(working.url)])
+    # Unreachable since its last health check
+    passed_check(dead)
+    assert pool.post("/sdapi/v1/txt2img", json=BODY).json()["images"]
+    assert working.settings.requests == 1
+    assert dead.healthy and dead.failures == 1
+
+
+def test_ejection_and_readmission(mocks):
+    port = free_port()
+    node = backend(f"http://127.0.0.1:{port}")
+    pool = BackendPool([node], acquire_timeout=10)
+    passed_check(node)
+    for _ in range(MAX_FAILURES):
+        assert node.healthy
+        with pytest.raises(requests.ConnectionError):
+            pool.post("/sdapi/v1/txt2img", json=BODY)
+    assert not node.healthy
+
+    # Jobs wait for the node to pass a health check again instead of failing
+    server = mocks(port=port)
+    assert pool.post("/sdapi/v1/txt2img", json=BODY).json()["images"]
+    assert node.healthy and node.failures == 0
+    assert server.settings.requests == 1
+
+
+def test_no_backend_can_run_job(mocks):
+    pool = BackendPool([backend(mocks().url)])
+    body = {**BODY, "alwayson_scripts": {"controlnet": {"args": [{"model": "missing"}]}}}
+    with pytest.raises(NoBackendAvailable):
+        pool.acquire(body)
+
+
+def test_interrupt_reaches_only_own_nodes(mocks):
+    first, second = mocks(), mocks()
+    pool = BackendPool([backend(first.url), backend(second.url)])
+    client = pool.client()
+    mine = pool.acquire(BODY, owner=client)
+    pool.acquire(BODY)
+    assert client.interrupt() == [mine.url]
@@ -0,0 +1,33 @@
+import io
+import os
+import zipfile
+
+from batch import DirectoryWriter, ZipWriter, output_name, run, unique_name
+
+
+def test_output_name_drops_directories():
+    assert output_name(3, "../escaped") == "escaped.png"
+    assert output_name(3, "/etc/cron.d/job.png") == "job.png"
+    assert output_name(3, "..\\..\\win") == "win.png"
+    assert output_name(3, "..") == output_name(3, "") == output_name(3) == "qr_000003.png"
+
+
+def test_unique_name():
+    used = set()
+    assert [unique_name(name, used) for name in ("a.png", "A.png", "a.png", "a_1.png")] == \
+        ["a.png", "A_1.png", "a_2.png", "a_1_1.png"]
+
+
+def test_run_stays_inside_the_output(tmp_path):
+    rows = [{"filename": "../escaped", "text": "one"}, {"filename": "code", "text": "two"},
+            {"filename": "sub/code", "text": "three"}]
+    out = os.path.join(tmp_path, "out")
+    assert run(rows, DirectoryWriter(out), "Text", workers=1, log=None) == (3, 0)
+    assert sorted(os.listdir(out)) == ["code.png", "code_1.png", "escaped.png"]
+    assert os.listdir(tmp_path) == ["out"]
+
+    buffer = io.BytesIO()
+    writer = ZipWriter(buffer)
+    run(rows, writer, "Text", workers=1, log=None)
+    writer.close()
+    assert zipfile.ZipFile(buffer).namelist() == ["escaped.png", "code.png", "code_1.png"]
@@ -0,0 +1,75 @@
+import os
+import time
+
+import pytest
+
+from job_store import JobStore, JobWorker, claim_size
+from mock_a1111 import MockA1111, MockSettings
+from qrgen import render_png
+from sweep import SweepResult, build_jobs
+
+PARAMS = {"steps": "2", "weight": "1.0", "guidance_start": "0", "guidance_end": "1", "hr_second_pass_steps": "5"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(os.path.join(tmp_path, "jobs.sqlite3"))
+
+
+def test_claim_size_whole_combinations():
+    assert claim_size({"concurrency": 2, "max_batch": 4, "max_iter": 2, "repeats": 7}) == 21
+    assert claim_size({"concurrency": 2, "max_batch": 2, "max_iter": 2, "repeats": 3}) == 9
+    assert claim_size({"concurrency": 2, "max_batch": 4, "max_iter": 2, "repeats": 8}) == 16
+    assert claim_size({"concurrency": 3}) == 3
+    for repeats in range(1, 20):
+        settings = {"concurrency": 2, "max_batch": min(repeats, 4), "max_iter": -(-repeats // 4), "repeats": repeats}
+        assert claim_size(settings) % repeats == 0
+
+
+def test_claim_keeps_combinations_together(store):
+    settings = {"concurrency": 1, "max_batch": 4, "max_iter": 2, "repeats": 7}
+    sweep_id = store.create_sweep(build_jobs(["a", "b"], [PARAMS], False, "control.png", 1, 7), "out", "control.png",
+                                  settings)
+    claimed = store.claim(sweep_id, claim_size(settings))
+    assert [(job.prompt, job.repeat) for job in claimed] == [(prompt, repeat) for prompt in "ab" for repeat in range(7)]
+
+
+def test_finish_queues_next_job(store):
+    first, second = build_jobs(["a"], [PARAMS] * 2, False, "control.png")
+    sweep_id = store.create_sweep([first], "out", "control.png", {})
+    job, = store.claim(sweep_id, 1)
+    store.finish(SweepResult(job, path="a.png", scannable=True), second)
+    assert [job.param_index for job in store.claim(sweep_id, 10)] == [1]
+    assert store.finished(sweep_id) == [(0, PARAMS, True)]
+
+
+def test_finish_skips_next_job_of_busy_prompt(store):
+    first, second, third = build_jobs(["a"], [PARAMS] * 3, False, "control.png")
+    # A retried job can leave a prompt with two unfinished jobs, they must not fork the search
+    sweep_id = store.create_sweep([first, second], "out", "control.png", {})
+    job = store.claim(sweep_id, 1)[0]
+    store.finish(SweepResult(job, error=RuntimeError("boom")), third)
+    assert [job.param_index for job in store.claim(sweep_id, 10)] == [1]
+    assert store.finished(sweep_id) == [(0, PARAMS, None)]
+
+
+def test_worker_batches_repeats(store, tmp_path):
+    mock = MockA1111(settings=MockSettings(latency=0.0)).start()
+    try:
+        control_path = os.path.join(tmp_path, "control.png")
+        with open(control_path, "wb") as f:
+            f.write(render_png("test"))
+        settings = {"concurrency": 2, "backends": mock.url, "use_cache": False, "repeats": 7, "max_batch": 4,
+                    "max_iter": 2}
+        jobs = build_jobs(["a", "b"], [PARAMS], False, control_path, 1, 7)
+        sweep_id = store.create_sweep(jobs, str(tmp_path), control_path, settings)
+        worker = JobWorker(store, poll_interval=0.1)
+        worker.start()
+        deadline = time.monotonic() + 30
+        while store.counts(sweep_id)["done"] < 14 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        mock.stop()
+    assert store.counts(sweep_id)["done"] == 14
+    # 4 + 3 images per combination
+    assert mock.settings.requests == 4
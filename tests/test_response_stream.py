@@ -0,0 +1,84 @@
+import base64
+import json
+import os
+import random
+
+import pytest
+
+from response_stream import ImageSink, parse_txt2img
+
+CHUNK_SIZES = [1, 2, 3, 5, 7, 64, 4096, 64 * 1024, 100 * 1024]
+
+INFO = json.dumps({
+    "prompt": 'a "quoted" prompt, C:\\models\\ and a trailing backslash \\',
+    "all_seeds": [1, 2, 3],
+    "extra": "tabs\t, new lines\n, unicode \u00e9\u4e2d\U0001f600 and escaped slashes </script>",
+})
+
+
+def _images(count=3, size=48 * 1024):
+    rng = random.Random(size)
+    return [bytes(rng.randrange(256) for _ in range(size + i)) for i in range(count)]
+
+
+def _response(images, indent=None, escape_slashes=False):
+    """A txt2img response like the webui sends, with the images between nested values."""
+    encoded = [base64.b64encode(image).decode() for image in images]
+    body = json.dumps({
+        "parameters": {
+            "prompt": 'quotes " and backslashes \\\\ and braces {[}]',
+            "empty": {}, "none": [], "nested": [[1, 2.5e-3, -7], {"a": {"b": [True, False, None]}}],
+            "alwayson_scripts": {"controlnet": {"args": [{"input_image": encoded[0], "weight": 1.25}]}},
+            "ends_with_escape": "\\",
+            "unicode": "\u00e9\u4e2d\U0001f600",
+        },
+        "images": encoded,
+        "info": INFO,
+        "seed": 1234567890,
+    }, indent=indent, ensure_ascii=not indent).encode()
+    if escape_slashes:
+        body = body.replace(b"/", b"\\/")
+    return body
+
+
+def _chunks(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("indent,escape_slashes", [(None, False), (2, False), (None, True)])
+def test_parse_matches_json(chunk_size, indent, escape_slashes):
+    images = _images()
+    body = _response(images, indent, escape_slashes)
+    output = parse_txt2img(_chunks(body, chunk_size), lambda index: ImageSink())
+    assert [sink.data for sink in output["images"]] == images
+    assert output["info"] == json.loads(body)["info"] == INFO
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 100 * 1024])
+def test_skipped_images_and_files(tmp_path, chunk_size):
+    images = _images()
+    body = _response(images)
+    paths = [os.path.join(tmp_path, f"{index}.png") for index in range(len(images))]
+    # Keep the first image only, like the control maps ControlNet appends after the result
+    output = parse_txt2img(_chunks(body, chunk_size),
+                           lambda index: ImageSink(paths[index]) if index == 0 else None)
+    assert len(output["images"]) == 1
+    with open(paths[0], "rb") as f:
+        assert f.read() == output["images"][0].data == images[0]
+    assert not os.path.exists(paths[1])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64])
+def test_data_uri_prefix(chunk_size):
+    image = _images(1, 1000)[0]
+    body = json.dumps({"images": ["data:image/png;base64," + base64.b64encode(image).decode()]}).encode()
+    output = parse_txt2img(_chunks(body, chunk_size), lambda index: ImageSink())
+    assert output["images"][0].data == image
+    assert output["info"] is None
+
+
+def test_truncated_response():
+    body = _response(_images(1, 1000))
+    with pytest.raises(ValueError):
+        parse_txt2img(_chunks(body[:len(body) // 2], 64), lambda index: ImageSink())
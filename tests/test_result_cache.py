@@ -0,0 +1,45 @@
+import os
+import time
+
+from result_cache import ResultCache
+
+
+def disk_bytes(root):
+    return sum(os.path.getsize(os.path.join(dirpath, name))
+               for dirpath, _, names in os.walk(root) for name in names)
+
+
+def image(tmp_path, size):
+    path = os.path.join(tmp_path, f"image_{size}.png")
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    return path
+
+
+def test_overwrite_keeps_size_in_sync(tmp_path):
+    cache = ResultCache(os.path.join(tmp_path, "cache"), max_bytes=10 ** 6)
+    for size in (1000, 3000, 500):
+        cache.put_file("ab" * 32, image(tmp_path, size), {"size": size})
+    assert cache._size == disk_bytes(cache.root)
+    assert cache.get("ab" * 32)[1] == {"size": 500}
+    # No temporary files left behind
+    assert sorted(os.listdir(os.path.join(cache.root, "ab"))) == ["ab" * 32 + ".json", "ab" * 32 + ".png"]
+    assert ResultCache(cache.root)._size == cache._size
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(os.path.join(tmp_path, "cache"), max_bytes=3500)
+    keys = [f"{index:02d}" * 32 for index in range(4)]
+    for index, key in enumerate(keys[:3]):
+        cache.put_file(key, image(tmp_path, 1000), {"index": index})
+        # Distinct modification times, eviction orders by them
+        os.utime(cache._path(key, "png"), (time.time() - 100 + index, time.time() - 100 + index))
+    cache.get(keys[0])
+    cache.put_file(keys[3], image(tmp_path, 1000), {"index": 3})
+    assert [cache.get(key) is not None for key in keys] == [True, False, True, True]
+    assert cache._size == disk_bytes(cache.root) <= cache.max_bytes
+
+    # Overwriting an entry must not count it twice and evict a live one
+    cache.put_file(keys[3], image(tmp_path, 1000), {"index": 3})
+    assert [cache.get(key) is not None for key in keys] == [True, False, True, True]
+    assert cache._size == disk_bytes(cache.root)
@@ -0,0 +1,48 @@
+from sweep import SweepJob, batch_shape, batchable, build_jobs, split_batch
+
+PARAMS = {"steps": "2", "weight": "1.0", "guidance_start": "0", "guidance_end": "1", "hr_second_pass_steps": "5"}
+
+
+def jobs(repeats, base_seed=1, params=(PARAMS,), prompts=("a",)):
+    return list(build_jobs(prompts, list(params), False, "control.png", base_seed, repeats))
+
+
+def test_split_batch():
+    assert split_batch(list(range(7)), 4) == [[0, 1, 2, 3], [4, 5, 6]]
+    assert split_batch(list(range(8)), 4) == [list(range(8))]
+    assert split_batch(list(range(3)), 4) == [[0, 1, 2]]
+    assert split_batch(list(range(9)), 4) == [list(range(8)), [8]]
+    assert split_batch([0], 1) == [[0]]
+
+
+def test_batch_shape():
+    # 7 repeats with max_batch 4 used to collapse to seven batches of one
+    assert [batch_shape(len(part), 4) for part in split_batch(list(range(7)), 4)] == [(4, 1), (3, 1)]
+    assert batch_shape(8, 4) == (4, 2)
+    assert batch_shape(13, 13) == (13, 1)
+    assert batch_shape(1, 4) == (1, 1)
+    assert batch_shape(6, 1) == (1, 6)
+
+
+def test_batchable_consecutive_seeds():
+    repeats = jobs(3)
+    assert batchable(repeats[:1], repeats[1])
+    assert batchable(repeats[:2], repeats[2])
+    # Seeds must follow on from the batch the way the webui seeds it
+    assert not batchable(repeats[:1], repeats[2])
+
+
+def test_batchable_random_seeds():
+    repeats = jobs(2, base_seed=-1)
+    assert batchable(repeats[:1], repeats[1])
+    fixed = SweepJob(0, 0, "a", PARAMS, False, "control.png", 5)
+    assert not batchable(repeats[:1], fixed)
+    assert not batchable([fixed], repeats[0])
+
+
+def test_batchable_same_request_only():
+    other_params = dict(PARAMS, weight="1.5")
+    first, second = jobs(1, params=(PARAMS, other_params))
+    assert not batchable([first], second)
+    first, second = jobs(1, prompts=("a", "b"))
+    assert not batchable([first], second)
@@ -0,0 +1,57 @@
+from itertools import product
+
+import pytest
+
+from utils import ParamGrid, dedupe_values, expand_range, parse_values
+
+
+def test_expand_range_is_inclusive_and_exact():
+    assert expand_range("0.8:1.0:0.05") == ["0.8", "0.85", "0.9", "0.95", "1"]
+    assert expand_range("1:3") == ["1", "2", "3"]
+    assert expand_range("0:1:0.3") == ["0", "0.3", "0.6", "0.9"]
+    assert expand_range("2:1:-0.5") == ["2", "1.5", "1"]
+    assert expand_range("10:100:50") == ["10", "60"]
+    assert expand_range("3:1") == []
+
+
+@pytest.mark.parametrize("value", ["1:2:0", "a:2", "1:2:3:4", "1"])
+def test_expand_range_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        expand_range(value)
+
+
+def test_dedupe_numeric_spellings():
+    assert dedupe_values(["1", "1.0", "1.00", "2", "02", "x", "x"]) == ["1", "2", "x"]
+    assert parse_values("1, 0.5:1.5:0.5, 1.0") == ["1", "0.5", "1", "1.5", "1.0"]
+    assert ParamGrid({"weight": "1, 0.5:1.5:0.5, 1.0"}).axes["weight"] == ["1", "0.5", "1.5"]
+
+
+def test_getitem_matches_product():
+    grid = ParamGrid({"a": "1,2,3", "b": "x,y", "c": None, "d": ["p", "q"]})
+    combinations = [dict(a=a, b=b, d=d, c=None) for a, b, d in product(["1", "2", "3"], ["x", "y"], ["p", "q"])]
+    assert len(grid) == 12
+    assert list(grid) == [grid[index] for index in range(12)] == combinations
+    assert grid[-1] == combinations[-1] and grid[-12] == combinations[0]
+    with pytest.raises(IndexError):
+        grid[12]
+    with pytest.raises(IndexError):
+        grid[-13]
+
+
+@pytest.mark.parametrize("method", ["random", "lhs"])
+@pytest.mark.parametrize("budget", [1, 7, 50, 119])
+def test_sample_returns_budget_unique_combinations(method, budget):
+    grid = ParamGrid({"a": "0:9", "b": "0:3", "c": "x,y,z"})
+    for seed in range(5):
+        sample = grid.sample(budget, method=method, seed=seed)
+        assert len(sample) == budget
+        assert len({tuple(row.items()) for row in sample}) == budget
+        indices = [list(grid).index(row) for row in sample]
+        assert indices == sorted(indices)
+
+
+def test_sample_budget_covers_grid():
+    grid = ParamGrid({"a": "1,2", "b": "3,4"})
+    assert grid.sample(10, method="lhs") == list(grid)
+    with pytest.raises(ValueError):
+        grid.sample(2, method="sobol")
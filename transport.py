@@ -0,0 +1,84 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+"""
+    Shared HTTP transport for talking to the automatic1111 webui.
+
+    One pooled keep-alive session is kept per backend URL so that every
+    txt2img call reuses an open connection instead of doing a new handshake.
+    The backend URL defaults to http://127.0.0.1:7860 and can be overridden
+    with the A1111_URL environment variable or per Transport instance.
+"""
+
+DEFAULT_BASE_URL = os.environ.get("A1111_URL", "http://127.0.0.1:7860")
+
+# Seconds to wait for the TCP connection / for the server to answer.
+# Reads are long because a hi-res txt2img job can take minutes on its own.
+CONNECT_TIMEOUT = float(os.environ.get("A1111_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.environ.get("A1111_READ_TIMEOUT", 600))
+
+# Answers of a webui that is starting up or behind a restarting proxy. A 500 is the job's
+# own error (CUDA out of memory, say) and would fail the same way again.
+RETRY_STATUS = (502, 503, 504)
+
+
+class Transport:
+    def __init__(self, base_url=None, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 retries=3, backoff_factor=0.5, pool_size=16):
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            # A read timeout means the webui may still be rendering the job: sending it
+            # again would queue a duplicate render behind it on the same GPU
+            read=0,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS,
+            # txt2img is a POST; those statuses mean it never started, so retrying is safe.
+            allowed_methods=frozenset(["GET", "POST"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def get(self, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.session.get(self.url(path), **kwargs)
+        response.raise_for_status()
+        return response
+
+    def post(self, path, json=None, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.session.post(self.url(path), json=json, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(base_url=None):
+    """Returns the shared Transport for base_url, creating it on first use."""
+    key = (base_url or DEFAULT_BASE_URL).rstrip("/")
+    with _transports_lock:
+        transport = _transports.get(key)
+        if transport is None:
+            transport = Transport(key)
+            _transports[key] = transport
+        return transport
@@ -1,27 +1,157 @@
+import random
+from decimal import Decimal, InvalidOperation
 from itertools import product
 
-def split_and_combine(input_dict):
-    """Splits the values of the input_dict by commas and returns all possible combinations."""
-    
-    # If a value is None or not a string, it's returned as is, otherwise it's split by comma
-    split_values = {
-        key: [v.strip() for v in value.split(',')] if isinstance(value, str) else value 
-        for key, value in input_dict.items() if value is not None
-    }
-
-    # Extract keys with None values
-    none_keys = [key for key, value in input_dict.items() if value is None]
-
-    # Compute the Cartesian product for the split values
-    combined_dicts = []
-    for combination in product(*split_values.values()):
-        combined_dict = dict(zip(split_values.keys(), combination))
-        
-        # Add keys with None values to the combined dictionary
-        for none_key in none_keys:
+
+def _to_decimal(value):
+    try:
+        number = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        return None
+    return number if number.is_finite() else None
+
+
+def _format_decimal(number):
+    # normalize() drops trailing zeros, format 'f' avoids exponents like 1E+2
+    return format(number.normalize(), 'f')
+
+
+def expand_range(value):
+    """Expands an inclusive 'start:stop:step' range into a list of value strings."""
+    parts = [part.strip() for part in value.split(':')]
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Invalid range '{value}', expected start:stop:step")
+    numbers = [_to_decimal(part) for part in parts]
+    if any(number is None for number in numbers):
+        raise ValueError(f"Invalid range '{value}', start, stop and step must be numbers")
+    start, stop = numbers[0], numbers[1]
+    step = numbers[2] if len(numbers) == 3 else Decimal(1)
+    if step == 0:
+        raise ValueError(f"Invalid range '{value}', step cannot be 0")
+    if (stop - start) * step < 0:
+        return []
+    count = int((stop - start) / step) + 1
+    return [_format_decimal(start + step * i) for i in range(count)]
+
+
+def parse_values(value):
+    """Splits a comma separated string into values, expanding any start:stop:step ranges."""
+    values = []
+    for part in value.split(','):
+        part = part.strip()
+        if ':' in part:
+            values.extend(expand_range(part))
+        else:
+            values.append(part)
+    return values
+
+
+def normalize_value(value):
+    """Returns a key that treats numerically equal values ('1' and '1.0') as the same."""
+    number = _to_decimal(value) if isinstance(value, (str, int, float)) else None
+    if number is not None:
+        return number.normalize()
+    return value
+
+
+def dedupe_values(values):
+    """Drops values that are duplicates after numeric normalization, keeping the first spelling."""
+    seen = set()
+    unique = []
+    for value in values:
+        key = normalize_value(value)
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(value)
+    return unique
+
+
+class ParamGrid:
+    """
+    Lazy Cartesian product of parameter values.
+
+    String values are split by commas and may contain inclusive ranges such as
+    '0.8:1.6:0.05'. Combinations are only built when iterated, indexed or sampled.
+    """
+
+    def __init__(self, input_dict):
+        # If a value is None it is carried through as is, lists are used directly
+        self.axes = {
+            key: dedupe_values(parse_values(value) if isinstance(value, str) else list(value))
+            for key, value in input_dict.items() if value is not None
+        }
+        self.none_keys = [key for key, value in input_dict.items() if value is None]
+
+    def __len__(self):
+        total = 1
+        for values in self.axes.values():
+            total *= len(values)
+        return total
+
+    def _combine(self, combination):
+        combined_dict = dict(zip(self.axes.keys(), combination))
+        for none_key in self.none_keys:
             combined_dict[none_key] = None
+        return combined_dict
+
+    def __iter__(self):
+        for combination in product(*self.axes.values()):
+            yield self._combine(combination)
+
+    def _indices(self, index):
+        # Mixed-radix decoding, the last axis varies fastest like itertools.product
+        indices = []
+        for values in reversed(list(self.axes.values())):
+            index, position = divmod(index, len(values))
+            indices.append(position)
+        return indices[::-1]
 
-        combined_dicts.append(combined_dict)
+    def __getitem__(self, index):
+        total = len(self)
+        if index < 0:
+            index += total
+        if not 0 <= index < total:
+            raise IndexError("ParamGrid index out of range")
+        combination = [values[i] for values, i in zip(self.axes.values(), self._indices(index))]
+        return self._combine(combination)
 
-    return combined_dicts
+    def _index_of(self, indices):
+        index = 0
+        for values, position in zip(self.axes.values(), indices):
+            index = index * len(values) + position
+        return index
 
+    def sample(self, budget, method="random", seed=None):
+        """
+        Returns at most budget combinations, in grid order.
+
+        method is 'random' for uniform sampling without replacement or 'lhs' for
+        Latin hypercube sampling, which spreads the picks evenly over every axis.
+        """
+        total = len(self)
+        if budget >= total:
+            return list(self)
+        rng = random.Random(seed)
+
+        if method == "random":
+            picked = set(rng.sample(range(total), budget))
+        elif method == "lhs":
+            columns = []
+            for values in self.axes.values():
+                column = [int((i + rng.random()) / budget * len(values)) for i in range(budget)]
+                rng.shuffle(column)
+                columns.append(column)
+            picked = {self._index_of(indices) for indices in zip(*columns)}
+            # Small axes make LHS rows collide; top up with random picks
+            while len(picked) < budget:
+                picked.add(rng.randrange(total))
+        else:
+            raise ValueError(f"Unknown sampling method '{method}'")
+
+        return [self[index] for index in sorted(picked)]
+
+
+def split_and_combine(input_dict):
+    """Splits the values of the input_dict by commas and returns all possible combinations."""
+    return list(ParamGrid(input_dict))